@@ -0,0 +1,291 @@
+# batch_reports.py
+#
+# Пакетная сборка заключений без Telegram: обследования из каталога или
+# манифеста проходят распознавание документов, анализ фото и generate_doc
+# в пуле процессов. Все процессы делят общий предел одновременных запросов
+# к OpenAI (--api-concurrency), лимиты RPM/TPM делятся между ними поровну.
+#
+#   python batch_reports.py surveys/ --out reports/ --workers 8 --api-concurrency 16
+#   python batch_reports.py manifest.jsonl --out reports/
+#
+# Каталог: surveys/<обследование>/<ключ>/*.jpg или surveys/<обследование>/<ключ>[_N].jpg,
+# ключи — как в PHOTO_KEYS бота (id_card, passport, facade, foundation, walls, roof, windows).
+# Манифест (.json — список, .jsonl — по объекту в строке):
+#   {"id": "дом_12", "id_card": "12/id.jpg", "facade": ["12/f1.jpg", "12/f2.jpg"], "address": "..."}
+# пути — относительно манифеста; прочие строковые поля попадают в данные отчёта
+# и не перезаписываются распознаванием.
+#
+# Готовый отчёт — <out>/<id>.docx; такие обследования при повторном запуске
+# пропускаются (продолжение после сбоя). Итог каждого обследования дописывается
+# в <out>/batch_state.jsonl.
+#
+# Локальный OCR (LOCAL_OCR) — один сервис на весь пакет: OCR_WORKERS процессов
+# с моделью в отдельном процессе-менеджере, воркеры обращаются к нему через прокси.
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+
+from utils import gpt_scheduler, image_prep, metrics, ocr_service, openai_client, photo_hash, photo_quality
+from utils.doc_extraction import EXTRACTED_FIELDS, LOCAL_OCR, extract_document
+from utils.doc_generator import ELEMENT_LABELS, generate_doc
+
+# Порядок ключей совпадает с шагами бота (PHOTO_KEYS): сначала документы, затем элементы
+KEYS = list(EXTRACTED_FIELDS) + list(ELEMENT_LABELS)
+IMAGE_EXT = {".jpg", ".jpeg", ".png", ".webp"}
+STATE_FILE = "batch_state.jsonl"
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Пакетная сборка заключений по каталогу или манифесту обследований")
+    p.add_argument("source", help="каталог обследований или манифест (.json/.jsonl)")
+    p.add_argument("--out", default="reports", help="каталог для отчётов")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов")
+    p.add_argument("--api-concurrency", type=int, default=16,
+                   help="одновременных запросов к OpenAI на все процессы")
+    p.add_argument("--force", action="store_true", help="пересобрать и уже готовые отчёты")
+    p.add_argument("--limit", type=int, help="не больше N обследований")
+    return p.parse_args(argv)
+
+
+# --- входные данные ---
+
+def _images(path: str) -> list:
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if os.path.splitext(name)[1].lower() in IMAGE_EXT
+    )
+
+
+def _key_of(name: str):
+    stem = os.path.splitext(name)[0]
+    for key in KEYS:
+        if stem == key or stem.startswith((f"{key}_", f"{key}-")):
+            return key
+    return None
+
+
+def load_directory(root: str) -> list:
+    surveys = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        survey = {"id": name}
+        for entry in sorted(os.listdir(path)):
+            full = os.path.join(path, entry)
+            if os.path.isdir(full) and entry in KEYS:
+                survey.setdefault(entry, []).extend(_images(full))
+            elif os.path.splitext(entry)[1].lower() in IMAGE_EXT and _key_of(entry):
+                survey.setdefault(_key_of(entry), []).append(full)
+        if any(key in survey for key in KEYS):
+            surveys.append(survey)
+        else:
+            logging.warning(f"{path}: нет фото ни для одного шага, пропущено")
+    return surveys
+
+
+def load_manifest(path: str) -> list:
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            items = [json.loads(line) for line in f if line.strip()]
+        else:
+            items = json.load(f)
+    surveys = []
+    for n, item in enumerate(items):
+        survey = {"id": str(item.get("id") or n)}
+        for field, value in item.items():
+            if field in KEYS:
+                paths = value if isinstance(value, list) else [value]
+                survey[field] = [os.path.join(base, p) for p in paths if p]
+            elif field != "id" and isinstance(value, str):
+                survey.setdefault("fields", {})[field] = value
+        surveys.append(survey)
+    return surveys
+
+
+def load_surveys(source: str) -> list:
+    if os.path.isdir(source):
+        return load_directory(source)
+    return load_manifest(source)
+
+
+# --- воркер ---
+
+class _OCRManager(BaseManager):
+    pass
+
+
+_OCRManager.register("OCRService", ocr_service.OCRService, exposed=("read_text", "warm_up", "shutdown"))
+
+
+def _init_worker(slots, ocr):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [{os.getpid()}] %(levelname)s %(message)s")
+    openai_client.set_api_slots(slots)
+    if ocr is not None:
+        ocr_service.set_service(ocr)
+
+
+def _usable_photos(paths: list) -> tuple:
+    # Та же проверка качества, что при загрузке в боте; возвращает (годные, отклонённые)
+    if not photo_quality.PHOTO_QUALITY:
+        return paths, []
+    good, bad = [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            problems = photo_quality.assess(f.read())["problems"]
+        (bad if problems else good).append(path)
+        if problems:
+            logging.warning(f"{path}: {photo_quality.describe(problems)}, в отчёт не включено")
+    return good, bad
+
+
+def _find_duplicates(paths: list) -> dict:
+    # {повтор: оригинал} среди фото одного элемента
+    known, duplicates = {}, {}
+    for path in paths:
+        with open(path, "rb") as f:
+            h = photo_hash.compute(f.read())
+        twin = photo_hash.find_twin(h, known)
+        if twin is None:
+            known[path] = h
+        else:
+            duplicates[path] = twin
+    return duplicates
+
+
+def build_report(survey: dict, out_dir: str) -> dict:
+    """Собирает отчёт одного обследования в <out_dir>/<id>.docx. Возвращает итог для сводки."""
+    metrics.current_survey.set(survey["id"])
+    started = time.perf_counter()
+    calls_before = metrics.total("gpt_requests_total")
+    result = {"id": survey["id"], "photos": sum(len(survey.get(key, [])) for key in KEYS)}
+    refs = [p for key in KEYS for p in survey.get(key, [])]
+    try:
+        data = dict(survey.get("fields", {}))
+        for doc_type, fields in EXTRACTED_FIELDS.items():
+            photos = survey.get(doc_type) or []
+            data[doc_type] = photos
+            if photos:
+                extracted = extract_document(photos[0], doc_type=doc_type)
+                for field, src in fields.items():
+                    if extracted.get(src) and field not in data:
+                        data[field] = extracted[src]
+
+        duplicates, rejected = {}, 0
+        for key in ELEMENT_LABELS:
+            photos, bad = _usable_photos(survey.get(key) or [])
+            rejected += len(bad)
+            duplicates.update(_find_duplicates(photos))
+            data[key] = photos
+        data["duplicates"] = duplicates
+
+        report = generate_doc(data)
+        path = os.path.join(out_dir, f"{survey['id']}.docx")
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(report.getbuffer())
+        os.replace(f"{path}.tmp", path)
+        result.update(status="done", rejected=rejected, duplicates=len(duplicates))
+    except Exception as e:
+        logging.exception(f"Обследование {survey['id']}: {e}")
+        result.update(status="failed", error=repr(e))
+    finally:
+        image_prep.forget(refs)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    result["gpt_calls"] = int(metrics.total("gpt_requests_total") - calls_before)
+    return result
+
+
+# --- запуск ---
+
+def _done_ids(out_dir: str) -> set:
+    return {os.path.splitext(name)[0] for name in os.listdir(out_dir) if name.endswith(".docx")}
+
+
+def _summary(results: list, skipped: int, wall: float) -> str:
+    done = [r for r in results if r["status"] == "done"]
+    failed = [r for r in results if r["status"] == "failed"]
+    lines = [
+        f"готово: {len(done)}, ошибок: {len(failed)}, пропущено (уже собраны): {skipped}",
+        f"время прогона: {wall:.1f} с",
+    ]
+    if done:
+        seconds = sorted(r["seconds"] for r in done)
+        photos = sum(r["photos"] for r in done)
+        lines += [
+            f"отчётов в минуту: {len(done) / wall * 60:.2f}, фото в секунду: {photos / wall:.2f}",
+            f"время на отчёт: p50 {statistics.median(seconds):.2f} с, "
+            f"p95 {seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))]:.2f} с",
+            f"запросов к OpenAI: {sum(r['gpt_calls'] for r in results)}, "
+            f"отклонено фото: {sum(r['rejected'] for r in done)}, повторов: {sum(r['duplicates'] for r in done)}",
+        ]
+    if failed:
+        lines.append("не собраны: " + ", ".join(r["id"] for r in failed[:20]) + (" ..." if len(failed) > 20 else ""))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    os.makedirs(args.out, exist_ok=True)
+
+    surveys = load_surveys(args.source)
+    if args.limit:
+        surveys = surveys[: args.limit]
+    done = set() if args.force else _done_ids(args.out)
+    todo = [s for s in surveys if s["id"] not in done]
+    workers = max(1, min(args.workers, len(todo) or 1))
+    logging.info(f"Обследований: {len(surveys)}, к сборке: {len(todo)}, процессов: {workers}")
+
+    # Настройки воркеров — через окружение (spawn-процессы читают его при импорте модулей):
+    # лимиты RPM/TPM делятся поровну, отчёты пишутся только в --out, фото пересжимаются в самом воркере
+    os.environ["GPT_RPM"] = str(gpt_scheduler.GPT_RPM / workers)
+    os.environ["GPT_TPM"] = str(gpt_scheduler.GPT_TPM / workers)
+    os.environ["REPORT_ARCHIVE"] = "0"
+    os.environ["PICTURE_WORKERS"] = "1"
+
+    ctx = multiprocessing.get_context("spawn")
+    slots = ctx.BoundedSemaphore(max(1, args.api_concurrency))
+    manager = ocr = None
+    if LOCAL_OCR and todo:
+        manager = _OCRManager(ctx=ctx)
+        manager.start()
+        ocr = manager.OCRService()
+    results = []
+    started = time.perf_counter()
+    try:
+        with open(os.path.join(args.out, STATE_FILE), "a", encoding="utf-8") as state, \
+                ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_worker, initargs=(slots, ocr)) as pool:
+            futures = {pool.submit(build_report, survey, args.out): survey for survey in todo}
+            for n, future in enumerate(as_completed(futures), 1):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Упавший процесс (BrokenProcessPool) проваливает все незавершённые обследования,
+                    # но не весь прогон: они отмечаются как не собранные и попадают в сводку
+                    survey = futures[future]
+                    logging.error(f"Обследование {survey['id']}: {e!r}")
+                    result = {"id": survey["id"], "photos": sum(len(survey.get(key, [])) for key in KEYS),
+                              "status": "failed", "error": repr(e), "seconds": 0.0, "gpt_calls": 0}
+                results.append(result)
+                state.write(json.dumps(dict(result, finished=time.time()), ensure_ascii=False) + "\n")
+                state.flush()
+                logging.info(f"[{n}/{len(todo)}] {result['id']}: {result['status']} за {result['seconds']:.1f} с")
+    finally:
+        if manager is not None:
+            ocr.shutdown()
+            manager.shutdown()
+
+    print(_summary(results, len(surveys) - len(todo), time.perf_counter() - started))
+    return 1 if any(r["status"] == "failed" for r in results) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+# bench/bench_e2e.py
+#
+# Сквозной нагрузочный прогон: синтетические обследования проходят через
+# настоящие хендлеры (start_conversation -> handle_photo -> handle_skip ->
+# generate_doc) против локального фейкового OpenAI и заглушек Telegram.
+# Обновления обрабатываются по одному, как в python-telegram-bot по умолчанию.
+#
+#   python -m bench.bench_e2e --users 5 --photos 3 --size 1600x1200 --latency 1.5
+#   python -m bench.bench_e2e --users 5 --save baseline     # сохранить baseline
+#   python -m bench.bench_e2e --users 5 --compare baseline  # сравнить с ним
+#   python -m bench.bench_e2e --users 3 --bad-rate 0.3     # испорченные ответы GPT: дозапросы и фолбэки
+#
+# Baseline-файлы лежат в bench/baselines/<имя>.json.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from bench import fake_telegram
+from bench.fake_openai import FakeOpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, "bench", "baselines")
+# Метрики для сравнения с baseline: имя -> больше значит лучше
+COMPARED = {
+    "p50_seconds": False,
+    "p95_seconds": False,
+    "reports_per_minute": True,
+    "peak_rss_mb": False,
+    "api_calls": False,
+}
+
+
+def _parse_args(argv):
+    p = argparse.ArgumentParser(description="Сквозной нагрузочный прогон бота")
+    p.add_argument("--users", type=int, default=3, help="одновременных обследований")
+    p.add_argument("--photos", type=int, default=2, help="фото на каждый конструктивный элемент")
+    p.add_argument("--size", default="1600x1200", help="размер синтетических фото, ШxВ")
+    p.add_argument("--latency", type=float, default=1.0, help="средняя задержка фейкового OpenAI, с")
+    p.add_argument("--jitter", type=float, default=0.3, help="разброс задержки OpenAI, с")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов 429/500/503")
+    p.add_argument("--bad-rate", type=float, default=0.0,
+                   help="доля ответов с неполным или не проходящим схему JSON")
+    p.add_argument("--download-latency", type=float, default=0.05, help="задержка скачивания фото из Telegram, с")
+    p.add_argument("--think", type=float, default=0.2, help="пауза пользователя между сообщениями, с")
+    p.add_argument("--timeout", type=float, default=600, help="предел на одно обследование, с")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--albums", action="store_true", help="отправлять фото элемента одним альбомом (media group)")
+    p.add_argument("--ocr", action="store_true", help="включить локальный OCR (нужен easyocr)")
+    p.add_argument("--save", metavar="NAME", help="сохранить результат как baseline")
+    p.add_argument("--compare", metavar="NAME", help="сравнить с сохранённым baseline")
+    return p.parse_args(argv)
+
+
+# --- синтетические фото ---
+
+def _make_photo(rng: np.random.Generator, width: int, height: int) -> bytes:
+    # Крупные блоки с резкими границами (у каждого фото своя «картинка» для хэшей,
+    # проверку резкости проходит) + мелкий шум (реалистичный размер JPEG)
+    coarse = rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((width, height), Image.NEAREST)
+    arr = np.asarray(img, dtype=np.int16) + rng.integers(-12, 13, size=(height, width, 3), dtype=np.int16)
+    buf = BytesIO()
+    Image.fromarray(arr.clip(0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _make_surveys(args, steps: int, element_steps: set) -> list:
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    rng = np.random.default_rng(args.seed)
+    surveys = []
+    for _ in range(args.users):
+        surveys.append([
+            [_make_photo(rng, width, height) for _ in range(args.photos if step in element_steps else 1)]
+            for step in range(steps)
+        ])
+    return surveys
+
+
+# --- замер памяти всего дерева процессов (пулы OCR/фото — дочерние процессы) ---
+
+class RSSSampler:
+    def __init__(self, interval: float = 0.2):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    @staticmethod
+    def _rss(pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _children(pid: int) -> list:
+        pids = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def _tree_rss(self) -> int:
+        total, stack = 0, [os.getpid()]
+        while stack:
+            pid = stack.pop()
+            total += self._rss(pid)
+            stack.extend(self._children(pid))
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._tree_rss())
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:  # нет /proc — хотя бы пик основного процесса
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return self.peak
+
+
+# --- прогон ---
+
+async def _run(args, surveys: list) -> dict:
+    from handlers import collector
+
+    steps = len(collector.QUESTIONS)
+    updates = asyncio.Queue()
+
+    async def dispatcher():
+        # Как Application по умолчанию: следующее обновление — после завершения хендлера
+        while True:
+            handler, update, done = await updates.get()
+            try:
+                await handler(update, fake_telegram.make_context())
+            finally:
+                done.set()
+
+    async def send(handler, update, think: bool = True):
+        done = asyncio.Event()
+        await updates.put((handler, update, done))
+        await done.wait()
+        if think and args.think:
+            await asyncio.sleep(args.think * random.uniform(0.5, 1.5))
+
+    async def survey(user_id: int, photos: list) -> float:
+        chat = fake_telegram.FakeChat(user_id, args.download_latency)
+        started = time.perf_counter()
+        await send(collector.start_conversation, fake_telegram.make_update(chat))
+        for step in range(steps):
+            # Альбом Telegram присылает пачкой обновлений без пауз между ними
+            album = f"{user_id}-{step}" if args.albums and len(photos[step]) > 1 else None
+            for i, data in enumerate(photos[step]):
+                uid = f"{user_id}-{step}-{i}"
+                await send(collector.handle_photo, fake_telegram.make_update(chat, data, uid, album),
+                           think=album is None or i == len(photos[step]) - 1)
+            await send(collector.handle_skip, fake_telegram.make_update(chat))
+        await asyncio.wait_for(chat.done.wait(), args.timeout)
+        return chat.document_at - started
+
+    worker = asyncio.create_task(dispatcher())
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(survey(1000 + i, photos) for i, photos in enumerate(surveys)), return_exceptions=True
+    )
+    wall = time.perf_counter() - started
+    worker.cancel()
+
+    durations = [r for r in results if isinstance(r, float)]
+    failures = [r for r in results if not isinstance(r, float)]
+    for e in failures:
+        print(f"обследование не завершилось: {e!r}", file=sys.stderr)
+    return {"durations": durations, "failures": len(failures), "wall": wall}
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def _compare(result: dict, name: str):
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, encoding="utf-8") as f:
+        base = json.load(f)
+    if base.get("config") != result["config"]:
+        print(f"внимание: параметры baseline {name} отличаются: {base.get('config')}")
+    print(f"\nсравнение с {name}:")
+    for key, higher_better in COMPARED.items():
+        old, new = base["results"].get(key), result["results"].get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_better else change < 0
+        mark = "=" if abs(change) < 1 else "лучше" if better else "хуже"
+        print(f"  {key:20} {old:10.2f} -> {new:10.2f}  ({change:+.1f}%, {mark})")
+
+
+def main(argv=None):
+    args = _parse_args(argv if argv is not None else sys.argv[1:])
+    random.seed(args.seed)
+
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+                      bad_rate=args.bad_rate, seed=args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench_e2e_")
+    # Настройки читаются модулями при импорте — выставляем до импорта хендлеров
+    os.environ["OPENAI_BASE_URL"] = fake.start()
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    os.environ.setdefault("GPT_CACHE", "0")
+    os.environ.setdefault("LOCAL_OCR", "1" if args.ocr else "0")
+    # Рабочие файлы (output/, temp/) — во временном каталоге; пакеты репозитория — по абсолютному пути
+    sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+
+    from handlers import collector
+    element_steps = {step for step, key in collector.PHOTO_KEYS.items()
+                     if key not in collector.EXTRACTED_FIELDS}
+    print(f"генерация фото ({args.users} обследований)...")
+    surveys = _make_surveys(args, len(collector.QUESTIONS), element_steps)
+
+    sampler = RSSSampler()
+    sampler.start()
+    run = asyncio.run(_run(args, surveys))
+    peak = sampler.stop()
+
+    durations = run["durations"]
+    calls = dict(sorted(fake.calls.items()))
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        "results": {
+            "surveys": len(durations),
+            "failures": run["failures"],
+            "p50_seconds": round(_percentile(durations, 50), 3),
+            "p95_seconds": round(_percentile(durations, 95), 3),
+            "reports_per_minute": round(len(durations) / run["wall"] * 60, 2),
+            "peak_rss_mb": round(peak / 2 ** 20, 1),
+            "api_calls": sum(calls.values()),
+            "api_calls_by_status": {str(k): v for k, v in calls.items()},
+            "api_images": fake.images,
+        },
+    }
+    fake.stop()
+
+    r = result["results"]
+    print(f"обследований: {r['surveys']} (ошибок: {r['failures']}), время прогона {run['wall']:.1f} с")
+    print(f"время до отчёта: p50 {r['p50_seconds']:.2f} с, p95 {r['p95_seconds']:.2f} с")
+    print(f"отчётов в минуту: {r['reports_per_minute']:.2f}")
+    print(f"пиковый RSS (с дочерними процессами): {r['peak_rss_mb']:.1f} МБ")
+    print(f"вызовов API: {r['api_calls']} {r['api_calls_by_status']}, изображений: {r['api_images']}")
+
+    if args.compare:
+        _compare(result, args.compare)
+    if args.save:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"baseline сохранён: {path}")
+
+
+if __name__ == "__main__":
+    main()
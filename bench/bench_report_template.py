@@ -0,0 +1,61 @@
+# bench/bench_report_template.py
+#
+# CPU-время на статическую часть отчёта: сборка через python-docx на каждый
+# запрос (как было) против копирования закэшированной заготовки.
+#
+#   python -m bench.bench_report_template [N]
+
+import sys
+import time
+from io import BytesIO
+
+from utils import report_template
+
+VALUES = {
+    "fio": "Иванов Иван Иванович",
+    "id_number": "123456789",
+    "id_date": "12.03.2020",
+    "address": "г. Алматы, ул. Ключевая, дом 14",
+    "cadastral_number": "03-046-140-1757",
+    "build_year": "2010",
+    "purpose": "жилое",
+    "facade_state": "удовлетворительное",
+    "foundation_state": "неудовлетворительное",
+    "walls_state": "удовлетворительное",
+    "roof_state": "удовлетворительное",
+    "windows_state": "удовлетворительное",
+}
+
+
+def _rebuild():
+    doc = report_template.build_skeleton()
+    doc.save(BytesIO())
+
+
+def _from_template():
+    doc = report_template.new_document(VALUES)
+    report_template.append_closing(doc, VALUES)
+    report_template.append_signatures(doc, VALUES)
+    doc.save(BytesIO())
+
+
+def _measure(fn, n: int) -> float:
+    fn()  # прогрев
+    start = time.process_time()
+    for _ in range(n):
+        fn()
+    return (time.process_time() - start) / n * 1000
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    report_template.load()
+    before = _measure(_rebuild, n)
+    after = _measure(_from_template, n)
+    print(f"python-docx на каждый отчёт: {before:.1f} мс CPU")
+    print(f"заготовка + плейсхолдеры:    {after:.1f} мс CPU")
+    print(f"ускорение: x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
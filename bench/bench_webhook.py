@@ -0,0 +1,144 @@
+# bench/bench_webhook.py
+#
+# Прогон webhook_server целиком: сервер запускается отдельным процессом с
+# WEBHOOK_WORKERS воркерами против локальных замен Bot API и OpenAI, каждый
+# пользователь проходит опрос обновлениями через webhook, как от Telegram.
+#
+#   python -m bench.bench_webhook --users 8 --workers 1
+#   python -m bench.bench_webhook --users 8 --workers 4
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import numpy as np
+
+from bench.bench_e2e import _make_photo
+from bench.fake_bot_api import FakeBotAPI
+from bench.fake_openai import FakeOpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS, ELEMENT_STEPS = 7, set(range(2, 7))
+SECRET = "bench-secret"
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Сквозной прогон webhook_server с заменами Telegram и OpenAI")
+    p.add_argument("--users", type=int, default=8)
+    p.add_argument("--photos", type=int, default=2, help="фото на каждый конструктивный элемент")
+    p.add_argument("--workers", type=int, default=2, help="WEBHOOK_WORKERS")
+    p.add_argument("--latency", type=float, default=0.5, help="задержка фейкового OpenAI, с")
+    p.add_argument("--timeout", type=float, default=300, help="предел на одно обследование, с")
+    p.add_argument("--seed", type=int, default=0)
+    return p.parse_args(argv)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(api: FakeBotAPI, port: int, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"webhook_server завершился с кодом {server.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as resp:
+                if resp.status == 200 and api.webhook:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError("webhook_server не поднялся")
+
+
+def _survey(api: FakeBotAPI, user_id: int, photos: list, acks: list, timeout: float) -> float:
+    """Проводит пользователя через опрос; возвращает время от /start до получения отчёта."""
+    started = time.perf_counter()
+    updates = [api.command(user_id, "start")]
+    for step_photos in photos:
+        updates += [api.photo(user_id, data) for data in step_photos]
+        updates.append(api.command(user_id, "skip"))
+    for update in updates:
+        t = time.perf_counter()
+        status = api.deliver(update)
+        acks.append(time.perf_counter() - t)
+        if status != 200:
+            raise RuntimeError(f"webhook ответил {status}")
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        for at, kind, _ in api.sent.get(user_id, []):
+            if kind == "document":
+                return at - started
+        time.sleep(0.05)
+    raise TimeoutError(f"пользователь {user_id}: отчёт не получен")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+    print(f"генерация фото ({args.users} обследований)...")
+    surveys = [
+        [[_make_photo(rng, 1280, 960) for _ in range(args.photos if step in ELEMENT_STEPS else 1)]
+         for step in range(STEPS)]
+        for _ in range(args.users)
+    ]
+
+    openai = FakeOpenAI(latency=args.latency, seed=args.seed)
+    api = FakeBotAPI()
+    port = _free_port()
+    env = dict(
+        os.environ,
+        OPENAI_BASE_URL=openai.start(), OPENAI_API_KEY="sk-bench",
+        TELEGRAM_BOT_TOKEN=api.token, TELEGRAM_API_URL=api.start(),
+        WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_PORT=str(port), WEBHOOK_SECRET=SECRET,
+        WEBHOOK_WORKERS=str(args.workers), LOCAL_OCR="0", GPT_CACHE="0", REPORT_ARCHIVE="0",
+    )
+    env.pop("PORT", None)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "webhook_server.py")], cwd=ROOT, env=env)
+    try:
+        _wait_ready(api, port, server)
+        acks, times, errors = [], [], []
+
+        def _run(user_id, photos):
+            try:
+                times.append(_survey(api, user_id, photos, acks, args.timeout))
+            except Exception as e:
+                errors.append(e)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=_run, args=(1000 + i, photos)) for i, photos in enumerate(surveys)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(30)
+        openai.stop()
+        api.stop()
+
+    for e in errors:
+        print(f"обследование не завершилось: {e!r}", file=sys.stderr)
+    acks.sort()
+    print(f"воркеров: {args.workers}, обследований: {len(times)} (ошибок: {len(errors)}), время прогона {wall:.1f} с")
+    if times:
+        times.sort()
+        print(f"время до отчёта: p50 {statistics.median(times):.2f} с, p95 {times[min(len(times) - 1, int(len(times) * 0.95))]:.2f} с")
+        print(f"отчётов в минуту: {len(times) / wall * 60:.2f}")
+    print(f"подтверждение webhook: p50 {statistics.median(acks) * 1000:.1f} мс, "
+          f"p95 {acks[min(len(acks) - 1, int(len(acks) * 0.95))] * 1000:.1f} мс ({len(acks)} обновлений)")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,167 @@
+# bench/fake_bot_api.py
+#
+# Локальная замена Telegram Bot API для webhook_server: отвечает на методы,
+# которыми пользуется бот (getMe, sendMessage, sendDocument, getFile,
+# setWebhook), отдаёт файлы фото и сам шлёт обновления на webhook, как это
+# делает Telegram. Ответы бота копятся по чатам в sent.
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+def _form(headers, body: bytes) -> tuple:
+    """Поля запроса Bot API (urlencoded, JSON или multipart) и размер приложенного файла."""
+    ctype = headers.get("Content-Type", "")
+    if ctype.startswith("application/json"):
+        return json.loads(body or b"{}"), 0
+    if ctype.startswith("multipart/form-data"):
+        msg = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+        fields, size = {}, 0
+        for part in msg.iter_parts():
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename():
+                size += len(payload)
+            else:
+                fields[part.get_param("name", header="content-disposition")] = payload.decode("utf-8")
+        return fields, size
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}, 0
+
+
+class FakeBotAPI:
+    def __init__(self, token: str = "123456:BENCH"):
+        self.token = token
+        self.lock = threading.Lock()
+        self.files = {}        # file_id -> bytes
+        self.sent = {}         # chat_id -> [(время, "text"|"document", текст или размер)]
+        self.webhook = None    # (url, secret_token)
+        self.server = None
+        self._update_id = 0
+        self._message_id = 0
+
+    # --- Bot API ---
+
+    def _message(self, chat_id, **fields) -> dict:
+        with self.lock:
+            self._message_id += 1
+            message_id = self._message_id
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "from": BOT_USER, **fields}
+
+    def _record(self, chat_id, kind: str, value):
+        with self.lock:
+            self.sent.setdefault(int(chat_id), []).append((time.perf_counter(), kind, value))
+
+    def _call(self, method: str, fields: dict, file_size: int):
+        if method == "getMe":
+            return BOT_USER
+        if method in ("setWebhook", "deleteWebhook"):
+            self.webhook = (fields.get("url"), fields.get("secret_token")) if method == "setWebhook" else None
+            return True
+        if method == "sendMessage":
+            self._record(fields["chat_id"], "text", fields.get("text", ""))
+            return self._message(fields["chat_id"], text=fields.get("text", ""))
+        if method == "sendDocument":
+            self._record(fields["chat_id"], "document", file_size)
+            return self._message(fields["chat_id"], document={
+                "file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex[:8], "file_size": file_size})
+        if method == "getFile":
+            data = self.files[fields["file_id"]]
+            return {"file_id": fields["file_id"], "file_unique_id": fields["file_id"][:8],
+                    "file_size": len(data), "file_path": f"photos/{fields['file_id']}.jpg"}
+        raise KeyError(method)
+
+    def start(self) -> str:
+        """Запускает сервер на свободном порту; возвращает адрес для TELEGRAM_API_URL."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                # /file/bot<token>/photos/<file_id>.jpg
+                file_id = self.path.rsplit("/", 1)[-1].split(".")[0]
+                data = fake.files.get(file_id)
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                method = self.path.rsplit("/", 1)[-1]
+                fields, size = _form(self.headers, body)
+                try:
+                    result = fake._call(method, fields, size)
+                except KeyError as e:
+                    self._reply(400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e}"})
+                    return
+                self._reply(200, {"ok": True, "result": result})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+
+    # --- обновления от «Telegram» ---
+
+    def _update(self, user_id: int, **message) -> dict:
+        with self.lock:
+            self._update_id += 1
+            update_id = self._update_id
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        return {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"}, "from": user, **message}}
+
+    def command(self, user_id: int, name: str) -> dict:
+        text = f"/{name}"
+        return self._update(user_id, text=text,
+                            entities=[{"type": "bot_command", "offset": 0, "length": len(text)}])
+
+    def photo(self, user_id: int, data: bytes, media_group_id: str = None) -> dict:
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = data
+        extra = {"media_group_id": media_group_id} if media_group_id else {}
+        return self._update(user_id, photo=[{
+            "file_id": file_id, "file_unique_id": file_id[:8],
+            "width": 1280, "height": 960, "file_size": len(data)}], **extra)
+
+    def deliver(self, update: dict, url: str = None, secret: str = None) -> int:
+        """POST обновления на webhook (по умолчанию — зарегистрированный setWebhook). Возвращает HTTP-статус."""
+        url, token = (url, secret) if url else self.webhook
+        req = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+        if token:
+            req.add_header("X-Telegram-Bot-Api-Secret-Token", token)
+        try:
+            with urllib.request.urlopen(req, timeout=10) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
@@ -0,0 +1,119 @@
+# bench/fake_openai.py
+#
+# Локальная замена chat.completions для нагрузочных прогонов: отвечает по
+# имени json_schema из response_format (пакет фото, поля документа, выводы)
+# с заданной задержкой и долей ошибок 429/500/503. bad_rate — доля ответов 200
+# с испорченным содержимым: в пакете фото нет последнего элемента, остальные
+# ответы не проходят схему.
+
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOCUMENT = {
+    "fio": "Иванов Иван Иванович",
+    "id_number": "123456789",
+    "id_date": "12.03.2020",
+    "address": "г. Алматы, ул. Ключевая, дом 14",
+    "cadastral_number": "03-046-140-1757",
+    "build_year": "2010",
+    "purpose": "жилое",
+}
+ERROR_STATUSES = (429, 500, 503)
+
+
+class FakeOpenAI:
+    def __init__(self, latency: float = 1.0, jitter: float = 0.3, fail_rate: float = 0.0,
+                 bad_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.bad_rate = bad_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}   # status -> число ответов
+        self.images = 0
+        self.server = None
+
+    def _count(self, status: int, images: int = 0):
+        with self.lock:
+            self.calls[status] = self.calls.get(status, 0) + 1
+            self.images += images
+
+    def _answer(self, body: dict, images: int, bad: bool = False) -> dict:
+        schema = (body.get("response_format") or {}).get("json_schema", {})
+        name = schema.get("name")
+        if name == "photo_batch":
+            content = {"items": [
+                {"index": i, "description": "трещины в штукатурке", "defects": "трещины",
+                 "overall_state": "удовлетворительное"}
+                for i in range(images)
+            ]}
+        elif name == "document_fields":
+            content = {f: DOCUMENT.get(f, "") for f in schema["schema"]["properties"]}
+        elif name == "conclusions":
+            content = {"overall_state": "удовлетворительное", "defects": "трещины",
+                       "recommendations": "устранить трещины"}
+        else:
+            content = "удовлетворительное состояние"
+        if bad and name == "photo_batch":
+            content["items"] = content["items"][:-1]
+        elif bad and isinstance(content, dict):
+            content = dict(list(content.items())[:-1])
+        text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 200 + 765 * images, "completion_tokens": 60 + 100 * images,
+                      "total_tokens": 260 + 865 * images},
+        }
+
+    def start(self) -> str:
+        """Запускает сервер на свободном порту; возвращает base_url для OPENAI_BASE_URL."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in (headers or {}).items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                images = sum(
+                    1 for msg in body.get("messages", []) if isinstance(msg.get("content"), list)
+                    for part in msg["content"] if part.get("type") == "image_url"
+                )
+                with fake.lock:
+                    delay = max(0.0, fake.latency + fake.random.uniform(-fake.jitter, fake.jitter))
+                    failed = fake.random.random() < fake.fail_rate
+                    status = fake.random.choice(ERROR_STATUSES) if failed else 200
+                    bad = fake.random.random() < fake.bad_rate
+                time.sleep(delay)
+                fake._count(status, images if status == 200 else 0)
+                if status != 200:
+                    self._reply(status, {"error": {"message": "bench failure", "type": "server_error"}},
+                                {"retry-after": "0.5"} if status == 429 else None)
+                    return
+                self._reply(200, fake._answer(body, images, bad))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
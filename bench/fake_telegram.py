@@ -0,0 +1,75 @@
+# bench/fake_telegram.py
+#
+# Минимальные заглушки Update/Message/File python-telegram-bot: ровно то,
+# чем пользуются хендлеры. Ответы бота копятся в chat.replies, момент
+# получения документа — в chat.document_at.
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+
+class FakeChat:
+    def __init__(self, user_id: int, download_latency: float = 0.0):
+        self.user_id = user_id
+        self.download_latency = download_latency
+        self.replies = []
+        self.document_size = None
+        self.document_at = None
+        self.done = asyncio.Event()
+
+
+class FakeFile:
+    def __init__(self, chat: FakeChat, data: bytes):
+        self.chat = chat
+        self.data = data
+        self.file_size = len(data)
+
+    async def download_as_bytearray(self, buf=None) -> bytearray:
+        if self.chat.download_latency:
+            await asyncio.sleep(self.chat.download_latency)
+        return bytearray(self.data)
+
+    async def download_to_memory(self, out):
+        out.write(await self.download_as_bytearray())
+
+
+class FakePhotoSize:
+    def __init__(self, chat: FakeChat, data: bytes, unique_id: str):
+        self.chat = chat
+        self.data = data
+        self.file_id = self.file_unique_id = unique_id
+        self.file_size = len(data)
+
+    async def get_file(self, *args, **kwargs) -> FakeFile:
+        return FakeFile(self.chat, self.data)
+
+
+class FakeMessage:
+    def __init__(self, chat: FakeChat, photo: bytes = None, unique_id: str = "", media_group_id: str = None):
+        self.chat = chat
+        self.photo = [FakePhotoSize(chat, photo, unique_id)] if photo is not None else []
+        self.media_group_id = media_group_id
+
+    async def reply_text(self, text: str, **kwargs):
+        self.chat.replies.append(text)
+
+    async def reply_document(self, document, **kwargs):
+        data = document.read() if hasattr(document, "read") else document
+        self.chat.document_size = len(data)
+        self.chat.document_at = time.perf_counter()
+        self.chat.done.set()
+
+
+def make_update(chat: FakeChat, photo: bytes = None, unique_id: str = "", media_group_id: str = None):
+    user = SimpleNamespace(id=chat.user_id)
+    return SimpleNamespace(
+        update_id=id(chat),
+        effective_user=user,
+        effective_chat=user,
+        message=FakeMessage(chat, photo, unique_id, media_group_id),
+    )
+
+
+def make_context():
+    return SimpleNamespace(bot_data={}, user_data={}, chat_data={}, args=[])
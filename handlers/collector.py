@@ -1,13 +1,29 @@
-import os
+import asyncio
 import logging
+import os
 from telegram import Update
 from telegram.ext import ContextTypes
-from utils.doc_generator import generate_doc
-from utils.extract_via_gpt import extract_structured_info_from_image
+from utils.doc_generator import generate_doc, ELEMENT_LABELS
+from utils.doc_extraction import EXTRACTED_FIELDS, LOCAL_OCR, extract_document
+from utils import jobs, photo_store, image_prep, analysis_pipeline, gpt_scheduler, media_groups, metrics, ocr_service, photo_hash, photo_quality
+from utils.session_store import SESSION_TTL, make_store
 
-user_data = {}
-current_step = {}
+# Состояние диалогов: шаг и собранные данные (память процесса или SQLite, см. SESSION_STORE)
+sessions = make_store()
+metrics.gauge("sessions_live", sessions.count)
+# Как часто убирать брошенные опросы (см. session_store.evict), секунд
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "300"))
+# /metrics и файл метрик — если заданы METRICS_PORT / METRICS_FILE
+metrics.start_exporter()
+# Модель локального OCR грузится при старте бота (и каждого webhook-воркера), а не на первом документе
+if LOCAL_OCR:
+    ocr_service.warm_up_in_background()
 END = -1
+# Опросы, по которым собирается отчёт: survey_id -> данные. Сессия из хранилища
+# к этому моменту уже снята, и новый /start не освободит фото этого отчёта
+_finishing = {}
+# С какого ожидания в GPT-очереди сообщать пользователю, секунд
+QUEUE_NOTICE_SECONDS = float(os.getenv("QUEUE_NOTICE_SECONDS", "30"))
 
 QUESTIONS = [
     "Загрузите фото удостоверения личности",
@@ -29,81 +45,287 @@ PHOTO_KEYS = {
     6: "windows",
 }
 
+def _session_photos(data: dict) -> list:
+    refs = []
+    for key in PHOTO_KEYS.values():
+        photos = data.get(key) or []
+        refs.extend(photos if isinstance(photos, list) else [photos])
+    return refs
+
+def release_photos(data: dict):
+    refs = _session_photos(data)
+    image_prep.forget(refs)
+    photo_store.release(refs)
+
+def _drop_user(user_id, data: dict):
+    # Всё, что держит опрос пользователя: альбомы, фоновый анализ и фото
+    media_groups.discard(user_id)
+    analysis_pipeline.discard(user_id)
+    release_photos(data or {})
+
+async def sweep():
+    """Удаляет брошенные опросы вместе с их фото и файлы, оставшиеся без сессий."""
+    # Сессии с незавершёнными задачами (распознавание, сборка отчёта) не трогаем
+    busy = jobs.active_users()
+    evicted = await asyncio.to_thread(sessions.evict, keep=busy)
+    for user_id, data, reason in evicted:
+        _drop_user(user_id, data)
+        metrics.inc("sessions_evicted_total", reason=reason)
+        metrics.trace("survey_evicted", survey_id=data.get("survey_id"), user_id=user_id, reason=reason)
+
+    live = set(sessions.user_ids())
+    for user_id in [uid for uid in jobs.job_states if uid not in live and uid not in busy]:
+        jobs.clear_state(user_id)
+
+    def _stale_files() -> int:
+        keep = [ref for uid in live for ref in _session_photos(sessions.get_data(uid) or {})]
+        keep += [ref for data in list(_finishing.values()) for ref in _session_photos(data)]
+        return photo_store.remove_stale(SESSION_TTL, keep)
+
+    removed = await asyncio.to_thread(_stale_files)
+    if evicted or removed:
+        logging.info(f"Очистка сессий: удалено опросов {len(evicted)}, файлов без сессии {removed}, активных {len(live)}")
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        try:
+            await sweep()
+        except Exception as e:
+            logging.exception(f"Ошибка очистки сессий: {e}")
+
+_sweeper = None
+
+def _ensure_sweeper():
+    # Фоновая очистка живёт в event loop бота; запускается с первым обновлением
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.create_task(_sweep_loop())
+
+def _bind_survey(user_id):
+    # Метрики и трассировка этого обновления (и задач, запущенных из него) — по текущему опросу
+    data = sessions.get_data(user_id) or {}
+    metrics.current_survey.set(data.get("survey_id"))
+
 async def start_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data[user_id] = {}
-    current_step[user_id] = 0
+    _ensure_sweeper()
+    _drop_user(user_id, sessions.pop(user_id))
+    sessions.create(user_id)
+    _bind_survey(user_id)
+    metrics.trace("survey_start", user_id=user_id)
 
     await update.message.reply_text("Здравствуйте! Загрузите, пожалуйста, фото документов.")
     await update.message.reply_text(QUESTIONS[0])
     return 1
 
-async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    step = current_step.get(user_id)
-    key = PHOTO_KEYS.get(step)
+async def _download(update) -> bytearray:
+    photo_file = await update.message.photo[-1].get_file()
+    return await photo_file.download_as_bytearray()
+
+def _mark_duplicates(user_id, key: str, refs: list, hashes: list) -> list:
+    """
+    Сравнивает хэши новых фото с фото этого же элемента и запоминает повторы
+    в сессии ({повтор: оригинал}). Возвращает номера повторов среди новых фото (с 1).
+    """
+    data = sessions.get_data(user_id) or {}
+    known_hashes = data.get("photo_hashes") or {}
+    duplicates = data.get("duplicates") or {}
+    # Сравниваем только с оригиналами того же элемента (включая фото этого же альбома)
+    known = {ref: known_hashes[ref] for ref in data.get(key) or []
+             if ref in known_hashes and ref not in duplicates}
+    repeats, new_duplicates = [], {}
+    for i, (ref, h) in enumerate(zip(refs, hashes), 1):
+        twin = photo_hash.find_twin(h, known)
+        if twin is None:
+            known[ref] = h
+        else:
+            new_duplicates[ref] = twin
+            repeats.append(i)
+    sessions.add_hashes(user_id, dict(zip(refs, hashes)), new_duplicates)
+    if repeats:
+        metrics.inc("photo_duplicates_total", len(repeats))
+    return repeats
 
+async def _store_photos(updates: list, user_id, key: str, survey_id):
+    """Скачивает фото (альбом — параллельно), добавляет их к шагу key и отвечает один раз."""
+    message = updates[0].message
     try:
-        photo_file = await update.message.photo[-1].get_file()
-        os.makedirs("temp", exist_ok=True)
+        # Фото держим в памяти; на диск — только при превышении бюджета photo_store
+        # или если хранилище сессий переживает перезапуск
+        with metrics.timer("download", step=key, photos=len(updates)):
+            datas = await asyncio.gather(*(_download(u) for u in updates))
+        metrics.inc("bytes_total", sum(len(d) for d in datas), stage="download")
 
-        # Поддержка нескольких фото
-        user_photos = user_data[user_id].get(key, [])
-        if not isinstance(user_photos, list):
-            user_photos = [user_photos] if user_photos else []
+        current = sessions.get_data(user_id)
+        if not current or current.get("survey_id") != survey_id:
+            raise KeyError(f"сессия пользователя {user_id} завершена")
+
+        # Размытое, тёмное или мелкое фото элемента просим переснять сразу — в анализ оно
+        # не попадёт. Документы не проверяем: чистый скан на белом фоне «пересвечен»
+        rejected = []
+        if photo_quality.PHOTO_QUALITY and key in ELEMENT_LABELS:
+            with metrics.timer("quality", step=key, photos=len(datas)):
+                checks = await asyncio.to_thread(lambda: [photo_quality.assess(d) for d in datas])
+            accepted = []
+            for i, (data, check) in enumerate(zip(datas, checks), 1):
+                if not check["problems"]:
+                    accepted.append(data)
+                    continue
+                rejected.append((i, check["problems"]))
+                for reason in check["problems"]:
+                    metrics.inc("photo_rejected_total", reason=reason)
+                logging.info(f"Фото пользователя {user_id} ({key}) отклонено: {check}")
+            datas = accepted
+        if rejected:
+            if len(updates) > 1:
+                notes = "; ".join(f"фото {i} — {photo_quality.describe(p)}" for i, p in rejected)
+            else:
+                notes = photo_quality.describe(rejected[0][1])
+            await message.reply_text(f"Фото не принято ({notes}). Переснимите, пожалуйста, при хорошем освещении и без смазывания.")
+            if not datas:
+                return
+
+        # Перцептивные хэши фото элемента — чтобы не анализировать повторы
+        hashes = None
+        if key in ELEMENT_LABELS:
+            hashes = await asyncio.to_thread(lambda: [photo_hash.compute(bytes(d)) for d in datas])
 
-        photo_path = f"temp/{user_id}_{key}_{len(user_photos) + 1}.jpg"
-        await photo_file.download_to_drive(photo_path)
-        user_photos.append(photo_path)
-        user_data[user_id][key] = user_photos
+        # Поддержка нескольких фото
+        first_count = None
+        refs = []
+        for i, data in enumerate(datas):
+            photo_ref = photo_store.put(data, f"{user_id}_{key}.jpg", persistent=sessions.persistent)
+            count = sessions.append_photo(user_id, key, photo_ref)
+            if count is None:
+                photo_store.release([photo_ref])
+                raise KeyError(f"сессия пользователя {user_id} завершена")
+            refs.append(photo_ref)
+            if i == 0:
+                first_ref, first_count = photo_ref, count
+        repeats = _mark_duplicates(user_id, key, refs, hashes) if hashes else []
+        # Набор фото элемента изменился — прежний фоновый анализ больше не актуален
+        analysis_pipeline.invalidate(user_id, key)
 
         # Автоматическое GPT-распознавание только при первом документе
-        if key == "id_card" and len(user_photos) == 1:
-            gpt_data = extract_structured_info_from_image(photo_path, doc_type="id_card")
-            await update.message.reply_text(f"Распознано: {gpt_data}")
-            user_data[user_id]["full_name"] = gpt_data.get("fio")
-            user_data[user_id]["id_number"] = gpt_data.get("id_number")
-            user_data[user_id]["id_date"] = gpt_data.get("id_date")
-
-        elif key == "passport" and len(user_photos) == 1:
-            gpt_data = extract_structured_info_from_image(photo_path, doc_type="passport")
-            await update.message.reply_text(f"Распознано: {gpt_data}")
-            user_data[user_id]["address"] = gpt_data.get("address")
-            user_data[user_id]["cadastral_number"] = gpt_data.get("cadastral_number")
-            user_data[user_id]["build_year"] = gpt_data.get("build_year")
-            user_data[user_id]["purpose"] = gpt_data.get("purpose")
-
-        await update.message.reply_text("Если у вас есть ещё фото этого элемента — отправьте. Или нажмите /skip чтобы перейти к следующему шагу.")
-        return 1
+        if key in EXTRACTED_FIELDS and first_count == 1:
+
+            async def _on_extracted(extracted, doc_type=key):
+                await message.reply_text(f"Распознано: {extracted}")
+                fields = {field: extracted.get(src) for field, src in EXTRACTED_FIELDS[doc_type].items()}
+                current = sessions.get_data(user_id)
+                if current and current.get("survey_id") == survey_id:
+                    sessions.update(user_id, fields)
+                elif survey_id in _finishing:
+                    # Опрос уже завершён — дополняем данные ожидающего отчёта
+                    _finishing[survey_id].update(fields)
+
+            async def _on_extract_failed(e):
+                await message.reply_text("Не удалось распознать документ. Данные можно будет уточнить позже.")
+
+            jobs.start_job(
+                user_id, "extract", extract_document, first_ref, doc_type=key,
+                on_done=_on_extracted, on_error=_on_extract_failed,
+            )
+            await message.reply_text("Документ принят, распознаю данные...")
+
+        prefix = f"Принято фото: {len(datas)}. " if len(datas) > 1 else ""
+        if repeats:
+            which = f"Фото {', '.join(map(str, repeats))}" if len(datas) > 1 else "Это фото"
+            prefix += f"{which} похоже на уже отправленное — повторно анализироваться не будет. "
+        await message.reply_text(prefix + "Если у вас есть ещё фото этого элемента — отправьте. Или нажмите /skip чтобы перейти к следующему шагу.")
 
     except Exception as e:
         logging.exception(f"Ошибка у пользователя {user_id}: {str(e)}")
+        await message.reply_text("Ошибка при обработке фото. Попробуйте снова или нажмите /cancel.")
+
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    _ensure_sweeper()
+    step = sessions.get_step(user_id)
+    key = PHOTO_KEYS.get(step)
+    _bind_survey(user_id)
+
+    if key is None:
+        logging.error(f"Ошибка у пользователя {user_id}: нет активного шага")
         await update.message.reply_text("Ошибка при обработке фото. Попробуйте снова или нажмите /cancel.")
         return 1
+    survey_id = (sessions.get_data(user_id) or {}).get("survey_id")
+
+    # Альбом приходит отдельными обновлениями — копим и обрабатываем его целиком
+    group_id = update.message.media_group_id
+    if group_id:
+        media_groups.add(
+            user_id, group_id, update,
+            lambda updates: _store_photos(updates, user_id, key, survey_id),
+        )
+        return 1
+
+    await _store_photos([update], user_id, key, survey_id)
+    return 1
 
 async def handle_skip(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    step = current_step.get(user_id)
-    current_step[user_id] += 1
+    # Альбом текущего шага, ещё ждущий последних фото, относится к этому шагу
+    await media_groups.flush(user_id)
+    steps = sessions.advance(user_id)
+    if steps is None:
+        await update.message.reply_text("Нет активного опроса. Начните заново: /start")
+        return END
+    step, next_step = steps
+    _bind_survey(user_id)
 
-    if current_step[user_id] < len(QUESTIONS):
-        await update.message.reply_text(QUESTIONS[current_step[user_id]])
+    # Элемент пройден — начинаем его анализ, пока пользователь загружает следующий
+    key = PHOTO_KEYS.get(step)
+    if key in ELEMENT_LABELS:
+        data = sessions.get_data(user_id) or {}
+        analysis_pipeline.schedule(
+            user_id, key, data.get(key), ELEMENT_LABELS[key], duplicates=data.get("duplicates"),
+        )
+
+    if next_step < len(QUESTIONS):
+        await update.message.reply_text(QUESTIONS[next_step])
         return 1
 
-    await update.message.reply_text("Все шаги завершены. Генерирую заключение...")
+    reply = "Все шаги завершены. Генерирую заключение..."
+    # Если GPT-очередь забита, честно предупреждаем об ожидании
+    wait = gpt_scheduler.estimated_wait(gpt_scheduler.BULK)
+    if wait >= QUEUE_NOTICE_SECONDS:
+        reply += f"\nЗапросов в очереди: {gpt_scheduler.queue_depth()}, ожидание около {round(wait / 60) or 1} мин."
+    await update.message.reply_text(reply)
+
+    # Генерация Word-файла в фоне. Сессия снимается с хранилища сразу: /start,
+    # пришедший раньше конца сборки, начнёт новый опрос, не трогая фото этого.
+    # Распознавание документов, которое ещё идёт, допишет данные в _finishing
+    data = sessions.pop(user_id) or {}
+    survey_id = data.get("survey_id")
+    _finishing[survey_id] = data
+    pending = analysis_pipeline.detach(user_id)
+    state = {"data": data}
+
+    async def _build():
+        # Задача стартует после распознавания документов (after_previous)
+        data = state["data"] = _finishing.pop(survey_id, state["data"])
+        with metrics.timer("analysis_wait", elements=list(pending)):
+            analysis = await analysis_pipeline.collect(pending, data)
+        return await jobs.run_job(user_id, "report", generate_doc, data, analysis)
+
+    async def _send(report):
+        release_photos(state["data"])
+        # Отчёт уходит прямо из памяти; копия на диске — забота report_delivery
+        with metrics.timer("upload", bytes=report.getbuffer().nbytes):
+            await update.message.reply_document(document=report, filename=report.name)
 
-    # Генерация Word-файла
-    path = generate_doc(user_data[user_id])
-    await update.message.reply_document(document=open(path, "rb"))
+    async def _failed(e):
+        _finishing.pop(survey_id, None)
+        release_photos(state["data"])
+        await update.message.reply_text("Ошибка при генерации заключения. Попробуйте снова: /start")
 
-    # Очистка
-    user_data.pop(user_id, None)
-    current_step.pop(user_id, None)
+    jobs.spawn(user_id, "report", _build, on_done=_send, on_error=_failed, after_previous=True)
     return END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     await update.message.reply_text("Операция отменена.")
-    user_data.pop(user_id, None)
-    current_step.pop(user_id, None)
+    _drop_user(user_id, sessions.pop(user_id))
     return END
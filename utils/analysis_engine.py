@@ -0,0 +1,140 @@
+# utils/analysis_engine.py
+
+import asyncio
+import os
+import weakref
+
+from utils import batch_planner, metrics
+from utils.gpt_photo_analysis_batch import analyze_photos_batch_async
+from utils.openai_client import aclose_async_client
+
+# Сколько запросов к GPT может выполняться одновременно
+MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "5"))
+
+# event loop -> Semaphore для долгоживущего loop бота
+_loop_semaphores = weakref.WeakKeyDictionary()
+
+
+async def _analyze_batch(sem, batch: list) -> list:
+    """Один запрос по пакету планировщика; оценки возвращаются с (key, index внутри элемента)."""
+    labels = [label for _, _, _, label in batch]
+    name = labels[0] if len(set(labels)) == 1 else labels
+    async with sem:
+        items = await analyze_photos_batch_async([photo for _, _, photo, _ in batch], name)
+    return [(batch[obj["index"]][0], dict(obj, index=batch[obj["index"]][1])) for obj in items]
+
+
+async def _analyze_planned(sem, elements: dict) -> dict:
+    batches = batch_planner.plan(elements)
+    results = {key: [] for key in elements}
+    for items in await asyncio.gather(*(_analyze_batch(sem, batch) for batch in batches)):
+        for key, obj in items:
+            results[key].append(obj)
+    return results
+
+
+async def _analyze_unique(sem, elements: dict) -> dict:
+    results = await _analyze_planned(sem, elements)
+
+    # Ответ разбирается по index: фото, не вошедшие в ответ, дозапрашиваются
+    # одним проходом планировщика и получают свои исходные номера
+    missing = {}
+    for key, (label, photos) in elements.items():
+        done = {obj["index"] for obj in results[key]}
+        idx = [i for i in range(len(photos)) if i not in done]
+        if idx:
+            missing[key] = idx
+    if missing:
+        count = sum(len(idx) for idx in missing.values())
+        metrics.inc("analysis_retry_photos_total", count)
+        metrics.trace("analysis_retry", photos=count, elements=list(missing))
+        retry = await _analyze_planned(
+            sem, {key: (elements[key][0], [elements[key][1][i] for i in idx]) for key, idx in missing.items()}
+        )
+        for key, idx in missing.items():
+            results[key] += [dict(obj, index=idx[obj["index"]]) for obj in retry[key]]
+
+    return {key: sorted(items, key=lambda obj: obj["index"]) for key, items in results.items()}
+
+
+async def analyze_group(sem, elements: dict, duplicates: dict = None) -> dict:
+    """
+    Анализ фото нескольких элементов: elements = {key: (label, [фото])}.
+    Фото раскладываются по запросам batch_planner; возвращает {key: [оценки по index]}.
+    duplicates {повтор: оригинал} — повторы в GPT не уходят и получают оценку оригинала.
+    """
+    duplicates = duplicates or {}
+    unique = {
+        key: (label, list(dict.fromkeys(duplicates.get(p, p) for p in photos)))
+        for key, (label, photos) in elements.items()
+    }
+    skipped = sum(len(photos) - len(unique[key][1]) for key, (_, photos) in elements.items())
+    if skipped:
+        metrics.inc("analysis_duplicates_skipped_total", skipped)
+
+    results = await _analyze_unique(sem, unique)
+    if not skipped:
+        return results
+
+    expanded = {}
+    for key, (_, photos) in elements.items():
+        refs = unique[key][1]
+        by_ref = {refs[obj["index"]]: obj for obj in results[key]}
+        expanded[key] = [
+            dict(by_ref[duplicates.get(p, p)], index=i)
+            for i, p in enumerate(photos) if duplicates.get(p, p) in by_ref
+        ]
+    return expanded
+
+
+async def analyze_element(sem, photos: list, label: str, duplicates: dict = None) -> list:
+    return (await analyze_group(sem, {label: (label, photos)}, duplicates))[label]
+
+
+def _shared_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    sem = _loop_semaphores.get(loop)
+    if sem is None:
+        sem = asyncio.Semaphore(max(1, MAX_CONCURRENCY))
+        _loop_semaphores[loop] = sem
+    return sem
+
+
+async def analyze_element_shared(photos: list, label: str, duplicates: dict = None) -> list:
+    """analyze_element с общим для текущего event loop лимитом параллельных запросов."""
+    return await analyze_element(_shared_semaphore(), photos, label, duplicates)
+
+
+async def analyze_elements(data: dict, labels: dict, max_concurrency: int = MAX_CONCURRENCY,
+                           duplicates: dict = None) -> dict:
+    """
+    Параллельный анализ всех конструктивных элементов.
+    Возвращает {key: [результаты]} в порядке labels; элементы без фото пропускаются.
+    """
+    sem = asyncio.Semaphore(max(1, max_concurrency))
+    keys = [key for key in labels if data.get(key)]
+
+    # Все элементы планируются вместе: мелкие попадают в общие запросы
+    results = await analyze_group(sem, {key: (labels[key], data[key]) for key in keys}, duplicates)
+    return {key: results[key] for key in keys}
+
+
+async def _analyze_elements_once(data: dict, labels: dict, max_concurrency: int, duplicates: dict) -> dict:
+    # Свой короткоживущий loop — закрываем его HTTP-клиент по завершении
+    try:
+        return await analyze_elements(data, labels, max_concurrency, duplicates)
+    finally:
+        await aclose_async_client()
+
+
+def run_analysis(data: dict, labels: dict, max_concurrency: int = MAX_CONCURRENCY,
+                 duplicates: dict = None) -> dict:
+    """
+    Синхронная обёртка над analyze_elements для generate_doc (вызывается в потоках jobs).
+    Внутри работающего event loop не блокируем его — там нужен await analyze_elements(...).
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_analyze_elements_once(data, labels, max_concurrency, duplicates))
+    raise RuntimeError("run_analysis вызван внутри event loop; используйте await analyze_elements(...)")
@@ -0,0 +1,85 @@
+# utils/analysis_pipeline.py
+#
+# Инкрементальный анализ: как только пользователь переходит к следующему
+# шагу, фото пройденного элемента уходят на анализ в фоне. К моменту
+# последнего /skip generate_doc остаётся только забрать готовые результаты.
+
+import asyncio
+import contextvars
+import logging
+
+from utils.analysis_engine import analyze_element_shared
+from utils.gpt_scheduler import current_user
+
+# user_id -> {key: {"photos": tuple, "task": asyncio.Task}}
+_pipelines = {}
+
+
+def _consume(task):
+    # Результат может так и не понадобиться — не даём asyncio ругаться на непрочитанную ошибку
+    if not task.cancelled():
+        task.exception()
+
+
+def schedule(user_id, key: str, photos: list, label: str, duplicates: dict = None):
+    """
+    Запускает анализ элемента; повторный вызов с теми же фото ничего не делает.
+    duplicates {повтор: оригинал} — см. analysis_engine.analyze_group.
+    """
+    photos = tuple(photos or ())
+    entries = _pipelines.setdefault(user_id, {})
+    entry = entries.get(key)
+    if entry and entry["photos"] == photos:
+        return
+    if entry:
+        entry["task"].cancel()
+    if not photos:
+        entries.pop(key, None)
+        return
+    # Запросы анализа идут в очередь GPT-планировщика от имени пользователя
+    ctx = contextvars.copy_context()
+    ctx.run(current_user.set, user_id)
+    task = asyncio.create_task(analyze_element_shared(list(photos), label, duplicates), context=ctx)
+    task.add_done_callback(_consume)
+    entries[key] = {"photos": photos, "task": task}
+
+
+def invalidate(user_id, key: str):
+    """Сбрасывает результат элемента (например, пользователь добавил к нему фото)."""
+    entry = _pipelines.get(user_id, {}).pop(key, None)
+    if entry:
+        entry["task"].cancel()
+
+
+def detach(user_id) -> dict:
+    """Забирает запущенные анализы пользователя из реестра (для сборки отчёта)."""
+    return _pipelines.pop(user_id, {})
+
+
+def discard(user_id):
+    for entry in detach(user_id).values():
+        entry["task"].cancel()
+
+
+async def collect(entries: dict, data: dict) -> dict:
+    """
+    Ждёт анализы из detach() и возвращает {key: результат} только для элементов,
+    фото которых совпадают с текущими data[key]. Упавшие анализы не попадают в результат.
+    """
+    keys = []
+    tasks = []
+    for key, entry in entries.items():
+        if entry["photos"] != tuple(data.get(key) or ()):
+            entry["task"].cancel()
+            continue
+        keys.append(key)
+        tasks.append(entry["task"])
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    analysis = {}
+    for key, result in zip(keys, results):
+        if isinstance(result, BaseException):
+            logging.warning(f"Фоновый анализ элемента {key} не удался: {result!r}")
+            continue
+        analysis[key] = result
+    return analysis
@@ -0,0 +1,70 @@
+# utils/batch_planner.py
+#
+# Раскладка фото обследования по GPT-запросам. Размер запроса ограничен
+# числом изображений, входными токенами на картинки и выходными токенами
+# на ответ (~BATCH_OUTPUT_TOKENS_PER_PHOTO на фото). Большой элемент
+# делится на примерно равные части, мелкие элементы доливаются в один
+# запрос вместе с другими. Каждая позиция пакета помнит элемент и номер
+# фото внутри элемента, чтобы разложить ответ обратно.
+
+import math
+import os
+
+from utils import image_prep
+from utils.gpt_scheduler import IMAGE_TOKENS
+
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "6"))
+BATCH_MAX_INPUT_TOKENS = int(os.getenv("BATCH_MAX_INPUT_TOKENS", "6000"))
+BATCH_MAX_OUTPUT_TOKENS = int(os.getenv("BATCH_MAX_OUTPUT_TOKENS", "1600"))
+BATCH_OUTPUT_TOKENS_PER_PHOTO = int(os.getenv("BATCH_OUTPUT_TOKENS_PER_PHOTO", "120"))
+BATCH_OUTPUT_OVERHEAD = 60
+
+
+def output_tokens(count: int) -> int:
+    """max_tokens для пакета из count фото."""
+    return min(BATCH_MAX_OUTPUT_TOKENS, BATCH_OUTPUT_OVERHEAD + BATCH_OUTPUT_TOKENS_PER_PHOTO * count)
+
+
+def max_images() -> int:
+    """Сколько фото помещается в один запрос при текущих лимитах."""
+    per_image = IMAGE_TOKENS.get(image_prep.IMAGE_DETAIL, IMAGE_TOKENS["auto"])
+    by_input = BATCH_MAX_INPUT_TOKENS // per_image
+    by_output = (BATCH_MAX_OUTPUT_TOKENS - BATCH_OUTPUT_OVERHEAD) // BATCH_OUTPUT_TOKENS_PER_PHOTO
+    return max(1, min(BATCH_MAX_IMAGES, by_input, by_output))
+
+
+def _split(items: list, limit: int) -> list:
+    # 13 фото при лимите 6 -> 5+4+4, а не 6+6+1: время ответа частей выравнивается
+    parts = math.ceil(len(items) / limit)
+    size, extra = divmod(len(items), parts)
+    chunks, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def plan(elements: dict, limit: int = None) -> list:
+    """
+    elements: {key: (label, [фото])}.
+    Возвращает список пакетов; пакет — список (key, index, фото, label),
+    фото одного элемента внутри пакета идут подряд.
+    """
+    limit = limit or max_images()
+    groups = []
+    for key, (label, photos) in elements.items():
+        items = [(key, i, photo, label) for i, photo in enumerate(photos or ())]
+        if items:
+            groups.extend(_split(items, limit))
+
+    # First-fit decreasing: крупные группы раньше, мелкие доливаются в свободные места
+    batches = []
+    for group in sorted(groups, key=len, reverse=True):
+        for batch in batches:
+            if len(batch) + len(group) <= limit:
+                batch.extend(group)
+                break
+        else:
+            batches.append(list(group))
+    return batches
@@ -0,0 +1,135 @@
+# utils/doc_extraction.py
+#
+# Распознавание документов по цепочке: локальный OCR + regex (image_parser),
+# проверка каждого поля с оценкой уверенности, и только для полей, которые
+# не удалось надёжно заполнить, — GPT-запрос с сокращённым списком полей.
+
+import logging
+import os
+import re
+from datetime import date, datetime
+
+from utils import metrics, ocr_service, photo_store
+from utils.extract_via_gpt import DOC_FIELDS, extract_structured_info_from_image
+from utils.image_parser import parse_text
+
+# Локальный OCR можно отключить (например, если easyocr не установлен)
+LOCAL_OCR = os.getenv("LOCAL_OCR", "1") != "0"
+# Минимальная уверенность, при которой поле не перепроверяется через GPT
+EXTRACT_CONFIDENCE = float(os.getenv("EXTRACT_CONFIDENCE", "0.8"))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "30"))
+
+# Поле сессии <- поле распознанного документа, для каждого типа документа
+EXTRACTED_FIELDS = {
+    "id_card": {
+        "full_name": "fio",
+        "id_number": "id_number",
+        "id_date": "id_date",
+    },
+    "passport": {
+        "address": "address",
+        "cadastral_number": "cadastral_number",
+        "build_year": "build_year",
+        "purpose": "purpose",
+    },
+}
+
+_FIO = re.compile(r"^[А-ЯЁӘҒҚҢӨҰҮҺІ][А-ЯЁӘҒҚҢӨҰҮҺІа-яёәғқңөұүһі\-]+(\s+[А-ЯЁӘҒҚҢӨҰҮҺІ][А-ЯЁӘҒҚҢӨҰҮҺІа-яёәғқңөұүһі\-]+){1,3}$")
+_ID_NUMBER = re.compile(r"^\d{9,12}$")
+_CADASTRAL = re.compile(r"^\d{2}-\d{3}-\d{3}-\d{4}$")
+_ADDRESS = re.compile(r"(ул\.?|улица|пр\.?|проспект|мкр|микрорайон)\s.+\b(д\.?|дом)\s*\d+", re.IGNORECASE)
+_PURPOSES = {"частный дом", "дача", "гараж"}
+
+
+def _score_fio(value, text):
+    return 0.9 if _FIO.match(value) else 0.0
+
+
+def _score_id_number(value, text):
+    return 0.95 if _ID_NUMBER.match(value) else 0.0
+
+
+def _score_id_date(value, text):
+    try:
+        d = datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return 0.0
+    return 0.9 if date(1991, 1, 1) <= d <= date.today() else 0.0
+
+
+def _score_address(value, text):
+    # Адрес из OCR часто обрезан — без улицы и номера дома отдаём GPT
+    return 0.85 if _ADDRESS.search(value) else 0.3
+
+
+def _score_cadastral(value, text):
+    return 0.95 if _CADASTRAL.match(value) else 0.0
+
+
+def _score_build_year(value, text):
+    if not value.isdigit() or not 1850 <= int(value) <= date.today().year:
+        return 0.0
+    # Первый попавшийся год в тексте может быть датой выдачи — уверены, только если рядом «год постройки»
+    if re.search(r"год\w*\s+(постройки|ввода|строительства)\D{0,20}" + value, text, re.IGNORECASE):
+        return 0.9
+    return 0.5
+
+
+def _score_purpose(value, text):
+    return 0.8 if value in _PURPOSES else 0.0
+
+
+VALIDATORS = {
+    "fio": _score_fio,
+    "id_number": _score_id_number,
+    "id_date": _score_id_date,
+    "address": _score_address,
+    "cadastral_number": _score_cadastral,
+    "build_year": _score_build_year,
+    "purpose": _score_purpose,
+}
+
+
+def score_fields(data: dict, text: str, doc_type: str) -> dict:
+    """Уверенность 0..1 для каждого поля документа."""
+    scores = {}
+    for field in DOC_FIELDS[doc_type]:
+        value = str(data.get(field) or "").strip()
+        scores[field] = VALIDATORS[field](value, text) if value else 0.0
+    return scores
+
+
+def _local_extract(image_ref: str, doc_type: str):
+    try:
+        text = ocr_service.read_text(photo_store.read(image_ref), timeout=OCR_TIMEOUT)
+    except Exception as e:
+        logging.warning(f"Локальный OCR недоступен, используем GPT: {e!r}")
+        return {}, ""
+    return parse_text(text, doc_type), text
+
+
+def extract_document(image_ref: str, doc_type: str = "id_card") -> dict:
+    """Поля документа в формате extract_structured_info_from_image."""
+    fields = DOC_FIELDS[doc_type]
+    result = {}
+
+    if LOCAL_OCR:
+        local, text = _local_extract(image_ref, doc_type)
+        scores = score_fields(local, text, doc_type)
+        result = {f: local[f] for f in fields if scores[f] >= EXTRACT_CONFIDENCE}
+        logging.info(f"Локальное распознавание {doc_type}: уверенность {scores}")
+
+    missing = [f for f in fields if f not in result]
+    metrics.inc("doc_fields_total", len(fields) - len(missing), doc_type=doc_type, source="local")
+    metrics.inc("doc_fields_total", len(missing), doc_type=doc_type, source="gpt")
+    metrics.inc("doc_gpt_requests_total", doc_type=doc_type, result="sent" if missing else "skipped")
+    if not missing:
+        return result
+
+    gpt_data = extract_structured_info_from_image(
+        image_ref, doc_type=doc_type, fields=None if len(missing) == len(fields) else missing
+    )
+    for f in missing:
+        if f in gpt_data:
+            result[f] = gpt_data[f]
+    return result
@@ -0,0 +1,156 @@
+# utils/gpt_cache.py
+#
+# Дисковый кэш ответов GPT. Ключ — sha256 от байтов изображений,
+# текста промпта, модели и параметров запроса, поэтому повторная
+# отправка того же фото не тратит ни секунд, ни токенов.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from utils import metrics, photo_store
+
+CACHE_ENABLED = os.getenv("GPT_CACHE", "1") != "0"
+CACHE_DIR = os.getenv("GPT_CACHE_DIR", "cache/gpt")
+CACHE_MAX_BYTES = int(os.getenv("GPT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+CACHE_MAX_AGE = int(os.getenv("GPT_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+
+_lock = threading.Lock()
+_total_bytes = None  # оценка размера кэша, считается при первом обращении
+
+
+def file_digest(path: str) -> str:
+    """sha256 фото по пути к файлу или ссылке photo_store."""
+    return hashlib.sha256(photo_store.read(path)).hexdigest()
+
+
+def make_key(model: str, prompt, images=(), **params) -> str:
+    """Ключ кэша: модель + промпт (строка или messages без картинок) + параметры + хэши изображений."""
+    h = hashlib.sha256()
+    head = {"model": model, "prompt": prompt, "params": params}
+    h.update(json.dumps(head, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for img in images:
+        h.update(file_digest(img).encode("ascii"))
+    return h.hexdigest()
+
+
+def _path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.json")
+
+
+def _scan():
+    entries = []
+    for root, _dirs, files in os.walk(CACHE_DIR):
+        for name in files:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+    return entries
+
+
+def _ensure_size():
+    global _total_bytes
+    if _total_bytes is None:
+        _total_bytes = sum(size for _, size, _ in _scan())
+
+
+def prune():
+    """Удаляет устаревшие записи, затем самые старые — пока кэш не станет меньше 90% лимита."""
+    global _total_bytes
+    with _lock:
+        entries = sorted(_scan())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if now - mtime <= CACHE_MAX_AGE and total <= CACHE_MAX_BYTES * 0.9:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            metrics.inc("gpt_cache_events_total", event="eviction")
+        _total_bytes = total
+
+
+def get(key: str):
+    """Значение из кэша или None."""
+    if not CACHE_ENABLED:
+        return None
+    path = _path(key)
+    try:
+        st = os.stat(path)
+        if time.time() - st.st_mtime > CACHE_MAX_AGE:
+            os.remove(path)
+            metrics.inc("gpt_cache_events_total", event="eviction")
+            metrics.inc("gpt_cache_events_total", event="miss")
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+        # Обновляем mtime, чтобы вытеснение шло по давности использования
+        os.utime(path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        metrics.inc("gpt_cache_events_total", event="miss")
+        return None
+    metrics.inc("gpt_cache_events_total", event="hit")
+    return value
+
+
+def put(key: str, value):
+    global _total_bytes
+    if not CACHE_ENABLED:
+        return
+    path = _path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = json.dumps(value, ensure_ascii=False).encode("utf-8")
+    # Атомарная запись: временный файл + rename
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning(f"Не удалось записать кэш GPT: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return
+    metrics.inc("gpt_cache_events_total", event="write")
+    with _lock:
+        _ensure_size()
+        _total_bytes += len(payload)
+        over = _total_bytes > CACHE_MAX_BYTES
+    if over:
+        prune()
+
+
+def cached(key: str, compute):
+    """Возвращает значение из кэша или вычисляет compute() и сохраняет непустой результат."""
+    value = get(key)
+    if value is not None:
+        return value
+    value = compute()
+    if value:
+        put(key, value)
+    return value
+
+
+async def acached(key: str, compute):
+    """То же, что cached, для корутин: compute() должна возвращать awaitable."""
+    value = get(key)
+    if value is not None:
+        return value
+    value = await compute()
+    if value:
+        put(key, value)
+    return value
@@ -1,11 +1,13 @@
 # utils/gpt_conclusions.py
 
-import os
-import json
+import logging
 from typing import Any, Mapping
-from openai import OpenAI
 
-client = OpenAI.api_key = os.getenv("OPENAI_API_KEY")
+from utils.openai_client import chat_completion
+from utils import gpt_cache
+from utils.structured_output import Conclusions, parse_model, response_format
+
+RESPONSE_FORMAT = response_format(Conclusions, "conclusions")
 
 
 def _format_defects(defects: Any) -> str:
@@ -62,8 +64,7 @@ def generate_conclusions(data: Mapping[str, Any]) -> Mapping[str, str]:
     system_msg = (
         "Ты — эксперт по техническому обследованию зданий. На вход подаётся результат "
         "анализов конструктивных элементов объекта недвижимости, сформируй по ним "
-        "финальные технические выводы и рекомендации. "
-        "Отвечай строго JSON-объектом, **без** markdown, без описаний, без текста до/после."
+        "финальные технические выводы и рекомендации."
     )
 
     user_msg = (
@@ -78,8 +79,16 @@ def generate_conclusions(data: Mapping[str, Any]) -> Mapping[str, str]:
         '"recommendations":"устранить трещины, проверить кровлю"}'
     )
 
+    key = gpt_cache.make_key(
+        "gpt-4o", [system_msg, user_msg], temperature=0.0, max_tokens=400, top_p=1.0,
+        response_format=RESPONSE_FORMAT
+    )
+    cached = gpt_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        resp = client.chat.completions.create(
+        resp = chat_completion(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_msg},
@@ -87,30 +96,24 @@ def generate_conclusions(data: Mapping[str, Any]) -> Mapping[str, str]:
             ],
             temperature=0.0,
             max_tokens=400,
-            top_p=1.0
+            top_p=1.0,
+            response_format=RESPONSE_FORMAT
         )
-        raw = resp.choices[0].message.content.strip()
-
-        # Удаляем возможные обрамления ```json``` или "`"
-        cleaned = raw.strip("`")
-        data_json = json.loads(cleaned)
-
+    except Exception as e:
+        logging.warning(f"Не удалось получить выводы от GPT: {e!r}")
         return {
-            "overall_state": data_json.get("overall_state", "—"),
-            "defects": data_json.get("defects", "—"),
-            "recommendations": data_json.get("recommendations", "—")
+            "overall_state": "ошибка при генерации",
+            "defects": "—",
+            "recommendations": "—"
         }
 
-    except (json.JSONDecodeError, ValueError) as ex:
-        # Optionally: лог raw здесь
+    parsed = parse_model(resp.choices[0].message.content, Conclusions)
+    if parsed is None:
         return {
             "overall_state": "ошибка при генерации заключения",
             "defects": "Не удалось распознать дефекты",
             "recommendations": "Не удалось составить рекомендации"
         }
-    except Exception:
-        return {
-            "overall_state": "ошибка при генерации",
-            "defects": "—",
-            "recommendations": "—"
-        }
+    result = parsed.model_dump()
+    gpt_cache.put(key, result)
+    return result
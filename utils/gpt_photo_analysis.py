@@ -1,33 +1,25 @@
-import base64
-import json
-import os
-import re
-from io import BytesIO
-from PIL import Image
-from openai import OpenAI
+from utils.openai_client import chat_completion
+from utils import gpt_cache, image_prep, photo_store
 
-client = OpenAI.api_key = os.getenv("OPENAI_API_KEY")
-
-def encode_image(image_path: str) -> str:
-    with Image.open(image_path) as img:
-        buf = BytesIO()
-        img.save(buf, format="JPEG")
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
 
 def analyze_photo(image_path: str, element_name: str) -> str:
-    b64 = encode_image(image_path)
     prompt = (
         f"Посмотри на фото элемента: {element_name}. "
         "Опиши его техническое состояние: наличие трещин, коррозии, повреждений. "
         "Верни только текст, без JSON, кратко, в одном предложении."
     )
-    response = client.chat.completions.create(
+    key = gpt_cache.make_key("gpt-4o", prompt, [image_path], max_tokens=200, temperature=0.2,
+                                image=image_prep.settings())
+    return gpt_cache.cached(key, lambda: _request(prompt, image_path))
+
+def _request(prompt: str, image_path: str) -> str:
+    response = chat_completion(
         model="gpt-4o",
         messages=[{
             "role": "user",
             "content": [
                 {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}" }}
+                image_prep.image_part(image_path)
             ]
         }],
         max_tokens=200,
@@ -45,7 +37,7 @@ def analyze_photos(data: dict) -> dict:
         ("windows", "Окна и двери")
     ]:
         path = data.get(key)
-        if path and os.path.exists(path):
+        if photo_store.exists(path):
             result[key] = analyze_photo(path, label)
         else:
             result[key] = "Фото не предоставлено"
@@ -1,66 +1,93 @@
 # utils/gpt_photo_analysis_batch.py
 
 import os
-import base64
-import json
-import re
-from io import BytesIO
-from PIL import Image
-from openai import OpenAI
+import asyncio
 
-# Обязательно передай свой ключ через env-переменную OPENAI_API_KEY
-client = OpenAI.api_key = os.getenv("OPENAI_API_KEY")
+from utils.openai_client import achat_completion, chat_completion
+from utils import batch_planner, gpt_cache, image_prep
+from utils.structured_output import PhotoBatch, parse_photo_items, response_format
 
-def encode_image(path: str) -> str:
-    with Image.open(path) as img:
-        buf = BytesIO()
-        img.save(buf, format="JPEG")
-        return base64.b64encode(buf.getvalue()).decode("utf-8")
 
-def analyze_photos_batch(paths: list, element_name: str) -> list:
-    prompt = (
-        f"Анализируй {len(paths)} фото элемента \"{element_name}\".\n"
-        "Для каждого фото в порядке отправки верни JSON-объект с полями:\n"
+# Пакет из нескольких фото отвечает дольше одиночного запроса
+BATCH_TIMEOUT = float(os.getenv("OPENAI_BATCH_TIMEOUT", "90"))
+
+RESPONSE_FORMAT = response_format(PhotoBatch, "photo_batch")
+
+def _describe(paths: list, element_name) -> str:
+    # element_name — название одного элемента или список названий по фото (смешанный пакет)
+    if isinstance(element_name, str):
+        return f"Анализируй {len(paths)} фото элемента \"{element_name}\".\n"
+    lines = [f"Анализируй {len(paths)} фото конструктивных элементов:\n"]
+    start = 0
+    for i in range(1, len(element_name) + 1):
+        if i == len(element_name) or element_name[i] != element_name[start]:
+            span = f"{start}" if i - 1 == start else f"{start}-{i - 1}"
+            lines.append(f"- фото {span}: элемент \"{element_name[start]}\"\n")
+            start = i
+    return "".join(lines)
+
+def build_prompt(paths: list, element_name) -> str:
+    return (
+        _describe(paths, element_name) +
+        "Для каждого фото в порядке отправки добавь в items объект с полями:\n"
         "- index: номер (с 0)\n"
         "- description: краткое описание состояния\n"
         "- defects: обнаруженные дефекты\n"
         "- overall_state: Категория V (аварийное состояние конструкции), неудовлетворительное, удовлетворительное\n"
-        "ОТВЕТЬ ТОЛЬКО JSON-МАССИВОМ, БЕЗ ОБЪЯСНЕНИЙ, БЕЗ ТЕКСТА ДО/ПОСЛЕ.\n"
-        "Пример ответа:\n"
-        '[{"index":0,"description":"...","defects":"...","overall_state":"..."}]'
     )
 
-    messages = [{
+def build_messages(paths: list, element_name) -> list:
+    prompt = build_prompt(paths, element_name)
+    return [{
         "role": "user",
         "content": [
             {"type": "text", "text": prompt},
         ] + [
-            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{encode_image(p)}"}}
-            for p in paths
+            image_prep.image_part(p) for p in paths
         ]
     }]
 
-    resp = client.chat.completions.create(
-        model="gpt-4o",
-        messages=messages,
-        max_tokens=800,
-        temperature=0.2
+def parse_batch_response(raw: str, count: int) -> list:
+    """Валидные оценки фото по порядку index; отсутствующие в ответе фото пропускаются."""
+    items = parse_photo_items(raw, count)
+    return [items[i].model_dump() for i in sorted(items)]
+
+def _cache_key(paths: list, element_name) -> str:
+    return gpt_cache.make_key(
+        "gpt-4o", build_prompt(paths, element_name), paths,
+        max_tokens=batch_planner.output_tokens(len(paths)), temperature=0.2,
+        image=image_prep.settings(), response_format=RESPONSE_FORMAT
     )
 
-    raw = resp.choices[0].message.content.strip()
-    # Очистка Markdown-кода и символов «```json» перед JSON
-    cleaned = re.sub(r"^```json|```$", "", raw.strip())
-    cleaned = cleaned.strip()
-    # Иногда OpenAI добавляет трейсинг или подпись — отрезаем лишнее после последней скобки
-    if cleaned.endswith("}") and cleaned.count("[") and cleaned.count("]"):
-        cleaned = cleaned[: cleaned.rfind("]") + 1 ]
+def analyze_photos_batch(paths: list, element_name) -> list:
+    def _request():
+        resp = chat_completion(
+            model="gpt-4o",
+            messages=build_messages(paths, element_name),
+            max_tokens=batch_planner.output_tokens(len(paths)),
+            temperature=0.2,
+            response_format=RESPONSE_FORMAT,
+            timeout=BATCH_TIMEOUT
+        )
+        return parse_batch_response(resp.choices[0].message.content, len(paths))
+
+    return gpt_cache.cached(_cache_key(paths, element_name), _request)
+
+async def analyze_photos_batch_async(paths: list, element_name) -> list:
+    # Тот же запрос, что и analyze_photos_batch, но асинхронный;
+    # хэширование и кодирование фото — в потоке, чтобы не держать event loop
+    key = await asyncio.to_thread(_cache_key, paths, element_name)
 
-    try:
-        parsed = json.loads(cleaned)
-        if isinstance(parsed, list):
-            return parsed
-    except json.JSONDecodeError as e:
-        print("JSON‑парсинг не удалось:", e, "-> raw:", repr(raw), "-> cleaned:", repr(cleaned))
+    async def _request():
+        messages = await asyncio.to_thread(build_messages, paths, element_name)
+        resp = await achat_completion(
+            model="gpt-4o",
+            messages=messages,
+            max_tokens=batch_planner.output_tokens(len(paths)),
+            temperature=0.2,
+            response_format=RESPONSE_FORMAT,
+            timeout=BATCH_TIMEOUT
+        )
+        return parse_batch_response(resp.choices[0].message.content, len(paths))
 
-    # fallback возврат — список пуст
-    return []
+    return await gpt_cache.acached(key, _request)
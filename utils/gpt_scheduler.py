@@ -0,0 +1,211 @@
+# utils/gpt_scheduler.py
+#
+# Общий планировщик GPT-запросов процесса. Перед каждым запросом
+# chat_completion/achat_completion получает разрешение:
+#   - token bucket на запросы (GPT_RPM) и на оценку токенов (GPT_TPM);
+#   - классы приоритета: INTERACTIVE (распознавание документов) раньше BULK
+#     (анализ элементов, выводы);
+#   - внутри класса — честная очередь по пользователям: n-й запрос любого
+#     пользователя идёт раньше (n+1)-го запроса другого;
+#   - не больше GPT_MAX_QUEUE ожидающих запросов, дальше — SchedulerBusy.
+# queue_depth()/estimated_wait() позволяют сообщить пользователю время ожидания.
+# Выданные/отклонённые разрешения и глубина очереди уходят в utils/metrics;
+# время ожидания разрешения пишет openai_client (gpt_queue_wait_seconds).
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+
+from utils import metrics
+
+INTERACTIVE = 0
+BULK = 1
+
+GPT_RPM = float(os.getenv("GPT_RPM", "500"))
+GPT_TPM = float(os.getenv("GPT_TPM", "30000"))
+GPT_MAX_QUEUE = int(os.getenv("GPT_MAX_QUEUE", "200"))
+
+# Оценка токенов на одно изображение: detail=low — фиксированные 85, иначе ~ 2x2 тайла
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+
+# Пользователь, от имени которого идут GPT-запросы в текущем контексте
+current_user = contextvars.ContextVar("gpt_current_user", default=None)
+
+
+class SchedulerBusy(Exception):
+    """Очередь GPT-запросов переполнена."""
+
+
+def estimate_tokens(messages: list, max_tokens: int = 0) -> int:
+    """Грубая оценка стоимости запроса: текст (~3 символа на токен) + изображения + max_tokens."""
+    chars = 0
+    images = 0
+    for msg in messages:
+        content = msg.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            elif part.get("type") == "image_url":
+                images += IMAGE_TOKENS.get(part["image_url"].get("detail", "auto"), 765)
+    return chars // 3 + images + (max_tokens or 0)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        # delta > 0 — вернуть переоценённые токены, < 0 — досписать
+        self.tokens = min(self.capacity, self.tokens + delta)
+
+
+class Scheduler:
+    def __init__(self, rpm: float = GPT_RPM, tpm: float = GPT_TPM, max_queue: int = GPT_MAX_QUEUE):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._pending = defaultdict(int)  # user_id -> ожидающих запросов
+
+    # --- очередь ---
+
+    def _enqueue(self, priority: int, user_id, est_tokens: int) -> list:
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                metrics.inc("gpt_scheduler_permits_total", result="rejected", priority=priority)
+                raise SchedulerBusy(f"в очереди GPT уже {len(self._heap)} запросов")
+            rank = self._pending[user_id]
+            self._pending[user_id] += 1
+            ticket = [priority, rank, next(self._seq), user_id, est_tokens, time.monotonic()]
+            heapq.heappush(self._heap, ticket)
+            return ticket
+
+    def _try_grant(self, ticket: list) -> float:
+        """0 — разрешение выдано; иначе через сколько секунд стоит проверить снова."""
+        with self._cond:
+            if not self._heap or self._heap[0] is not ticket:
+                return 0.05
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(ticket[4], now))
+            if wait > 0:
+                return wait
+            heapq.heappop(self._heap)
+            self._forget_user(ticket[3])
+            self.requests.take(1)
+            self.tokens.take(ticket[4])
+            metrics.inc("gpt_scheduler_permits_total", result="granted", priority=ticket[0])
+            self._cond.notify_all()
+            return 0.0
+
+    def _forget_user(self, user_id):
+        self._pending[user_id] -= 1
+        if self._pending[user_id] <= 0:
+            del self._pending[user_id]
+
+    def _cancel(self, ticket: list):
+        with self._cond:
+            if ticket in self._heap:
+                self._heap.remove(ticket)
+                heapq.heapify(self._heap)
+                self._forget_user(ticket[3])
+                self._cond.notify_all()
+
+    # --- публичный интерфейс ---
+
+    def acquire(self, priority: int = BULK, user_id=None, est_tokens: int = 0, timeout: float = None):
+        """Блокирует поток до получения разрешения. Возвращает билет для release()."""
+        ticket = self._enqueue(priority, user_id, est_tokens)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    return ticket
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise SchedulerBusy("не дождались очереди GPT")
+                with self._cond:
+                    self._cond.wait(min(wait, 1.0))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def acquire_async(self, priority: int = BULK, user_id=None, est_tokens: int = 0):
+        """Асинхронный вариант acquire: ждёт через asyncio.sleep, не блокируя event loop."""
+        ticket = self._enqueue(priority, user_id, est_tokens)
+        try:
+            while True:
+                wait = self._try_grant(ticket)
+                if wait == 0:
+                    return ticket
+                await asyncio.sleep(min(wait, 0.25))
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def release(self, ticket: list, used_tokens: int = None):
+        """Поправляет бюджет токенов по фактическому usage из ответа."""
+        if used_tokens is None:
+            return
+        with self._cond:
+            self.tokens.adjust(ticket[4] - used_tokens)
+            self._cond.notify_all()
+
+    def queue_depth(self, priority: int = None) -> int:
+        with self._cond:
+            if priority is None:
+                return len(self._heap)
+            return sum(1 for t in self._heap if t[0] <= priority)
+
+    def estimated_wait(self, priority: int = BULK, est_tokens: int = 0) -> float:
+        """Сколько примерно ждать запросу данного приоритета, поставленному сейчас, секунд."""
+        with self._cond:
+            ahead = [t for t in self._heap if t[0] <= priority]
+            now = time.monotonic()
+            self.tokens._refill(now)
+            self.requests._refill(now)
+            tokens_needed = sum(t[4] for t in ahead) + est_tokens - self.tokens.tokens
+            requests_needed = len(ahead) + 1 - self.requests.tokens
+        return max(0.0, tokens_needed / self.tokens.rate, requests_needed / self.requests.rate)
+
+
+_scheduler = Scheduler()
+metrics.gauge("gpt_scheduler_queue_depth", _scheduler.queue_depth)
+
+
+def get_scheduler() -> Scheduler:
+    return _scheduler
+
+
+def queue_depth(priority: int = None) -> int:
+    return _scheduler.queue_depth(priority)
+
+
+def estimated_wait(priority: int = BULK, est_tokens: int = 0) -> float:
+    return _scheduler.estimated_wait(priority, est_tokens)
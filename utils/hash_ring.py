@@ -0,0 +1,27 @@
+# utils/hash_ring.py
+#
+# Консистентное хэширование ключей (user_id) по узлам (процессам-воркерам):
+# у каждого узла REPLICAS виртуальных точек на кольце, ключ достаётся первой
+# точке по часовой стрелке. При изменении числа узлов переезжает только
+# ~1/N ключей, остальные пользователи остаются на своих воркерах.
+
+import bisect
+import hashlib
+
+REPLICAS = 64
+
+
+def _hash(value) -> int:
+    return int.from_bytes(hashlib.md5(str(value).encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = REPLICAS):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key):
+        """Узел, которому принадлежит ключ."""
+        i = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[i]
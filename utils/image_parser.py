@@ -1,11 +1,14 @@
-import easyocr
 import re
 
-reader = easyocr.Reader(['ru', 'en'], gpu=False)
+from utils import ocr_service, photo_store
 
 def extract_relevant_data(image_path: str, doc_type: str) -> dict:
-    result = reader.readtext(image_path, detail=0, paragraph=True)
-    text = ' '.join(result).replace('\n', ' ').replace("  ", " ")
+    # OCR выполняется в пуле процессов ocr_service, модель загружена там один раз
+    text = ocr_service.read_text(photo_store.read(image_path))
+    return parse_text(text, doc_type)
+
+def parse_text(text: str, doc_type: str) -> dict:
+    text = text.replace('\n', ' ').replace("  ", " ")
     data = {}
 
     if doc_type == 'id_card':
@@ -18,6 +21,8 @@ def extract_relevant_data(image_path: str, doc_type: str) -> dict:
         num_date_match = re.search(r'(ID|№|N)?\s?(\d{9,})[^0-9]*(\d{2}\.\d{2}\.\d{4})', text)
         if num_date_match:
             data['id_number_date'] = f"{num_date_match.group(2)} от {num_date_match.group(3)}"
+            data['id_number'] = num_date_match.group(2)
+            data['id_date'] = num_date_match.group(3)
 
     elif doc_type == 'passport':
         # Адрес: ищем строку с ул., дом, кв.
@@ -0,0 +1,81 @@
+# utils/image_prep.py
+#
+# Общая подготовка фото перед отправкой в модель: уменьшение до
+# IMAGE_MAX_SIDE по длинной стороне и JPEG с заданным качеством.
+# Уже подходящие JPEG отправляются как есть, результат кодирования
+# запоминается, чтобы одно фото не перекодировалось несколько раз за опрос.
+
+import base64
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from utils import metrics, photo_store
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# low | high | auto — параметр detail у image_url в chat.completions
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto")
+IMAGE_MEMO_SIZE = int(os.getenv("IMAGE_MEMO_SIZE", "64"))
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def settings() -> dict:
+    """Текущие параметры подготовки — входят в ключ кэша GPT."""
+    return {"max_side": IMAGE_MAX_SIDE, "quality": IMAGE_JPEG_QUALITY, "detail": IMAGE_DETAIL}
+
+
+def prepare_image(path: str, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    """JPEG-байты фото (путь или ссылка photo_store) не больше max_side по длинной стороне."""
+    with Image.open(photo_store.source(path)) as img:
+        if img.format == "JPEG" and max(img.size) <= max_side:
+            return photo_store.read(path)
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        return buf.getvalue()
+
+
+def encode_image(path: str, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> str:
+    """base64 подготовленного фото; повторные вызовы для того же файла берутся из памяти."""
+    key = (path, photo_store.version(path), max_side, quality)
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+
+    with metrics.timer("encode"):
+        encoded = base64.b64encode(prepare_image(path, max_side, quality)).decode("utf-8")
+    metrics.inc("bytes_total", len(encoded), stage="encode")
+
+    with _memo_lock:
+        _memo[key] = encoded
+        while len(_memo) > IMAGE_MEMO_SIZE:
+            _memo.popitem(last=False)
+    return encoded
+
+
+def image_part(path: str, detail: str = IMAGE_DETAIL) -> dict:
+    """Элемент content для сообщения chat.completions с фото."""
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:image/jpeg;base64,{encode_image(path)}", "detail": detail},
+    }
+
+
+def forget(paths):
+    """Убирает из памяти закодированные фото (например, по завершении опроса)."""
+    paths = set(paths)
+    with _memo_lock:
+        for key in [k for k in _memo if k[0] in paths]:
+            del _memo[key]
@@ -0,0 +1,126 @@
+# utils/jobs.py
+#
+# Выполнение тяжёлых синхронных задач (GPT-распознавание, сборка docx)
+# в пуле потоков, чтобы не блокировать event loop бота.
+
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.gpt_scheduler import current_user
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+
+# user_id -> {kind: state}
+job_states = {}
+# user_id -> незавершённые asyncio-задачи пользователя
+_user_tasks = {}
+
+
+def get_state(user_id, kind: str):
+    return job_states.get(user_id, {}).get(kind)
+
+
+def _set_state(user_id, kind: str, state: str):
+    job_states.setdefault(user_id, {})[kind] = state
+
+
+def _run(user_id, kind, fn, args, kwargs):
+    _set_state(user_id, kind, RUNNING)
+    # GPT-запросы задачи попадают в очередь планировщика от имени пользователя
+    token = current_user.set(user_id)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        current_user.reset(token)
+
+
+async def run_job(user_id, kind: str, fn, *args, **kwargs):
+    """Выполняет fn(*args, **kwargs) в пуле и ждёт результат, отслеживая состояние."""
+    _set_state(user_id, kind, QUEUED)
+    loop = asyncio.get_running_loop()
+    # Пул потоков не переносит contextvars сам (survey_id для метрик и т.п.)
+    ctx = contextvars.copy_context()
+    try:
+        result = await loop.run_in_executor(_executor, ctx.run, _run, user_id, kind, fn, args, kwargs)
+    except Exception:
+        _set_state(user_id, kind, FAILED)
+        raise
+    _set_state(user_id, kind, DONE)
+    return result
+
+
+def spawn(user_id, kind: str, make_coro, on_done=None, on_error=None,
+          after_previous: bool = False) -> asyncio.Task:
+    """
+    Запускает корутину make_coro() как фоновую задачу пользователя.
+    on_done(result) / on_error(exc) — корутины, вызываются в event loop по завершении.
+    after_previous=True — сначала дождаться уже запущенных задач этого пользователя.
+    """
+    previous = list(_user_tasks.get(user_id, ())) if after_previous else []
+
+    async def _job():
+        if previous:
+            await asyncio.gather(*previous, return_exceptions=True)
+        try:
+            result = await make_coro()
+        except Exception as e:
+            logging.exception(f"Задача {kind} пользователя {user_id} завершилась ошибкой: {e}")
+            callback, arg = on_error, e
+        else:
+            callback, arg = on_done, result
+        if not callback:
+            return
+        # Ошибка обработчика (например, сбой отправки сообщения) не должна
+        # теряться в необработанном исключении фоновой задачи
+        try:
+            await callback(arg)
+        except Exception as e:
+            logging.exception(f"Обработчик завершения задачи {kind} пользователя {user_id} упал: {e}")
+
+    task = asyncio.create_task(_job())
+    tasks = _user_tasks.setdefault(user_id, set())
+    tasks.add(task)
+
+    def _forget(t):
+        tasks.discard(t)
+        if not tasks and _user_tasks.get(user_id) is tasks:
+            _user_tasks.pop(user_id, None)
+
+    task.add_done_callback(_forget)
+    return task
+
+
+def start_job(user_id, kind: str, fn, *args, on_done=None, on_error=None,
+              after_previous: bool = False, **kwargs) -> asyncio.Task:
+    """Ставит синхронную fn(*args, **kwargs) в пул и сразу возвращает управление (см. spawn)."""
+    _set_state(user_id, kind, QUEUED)
+    return spawn(
+        user_id, kind, lambda: run_job(user_id, kind, fn, *args, **kwargs),
+        on_done=on_done, on_error=on_error, after_previous=after_previous,
+    )
+
+
+async def wait_jobs(user_id):
+    """Ждёт завершения всех текущих задач пользователя."""
+    tasks = list(_user_tasks.get(user_id, ()))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def active_users() -> set:
+    """Пользователи с незавершёнными фоновыми задачами."""
+    return set(_user_tasks)
+
+
+def clear_state(user_id):
+    job_states.pop(user_id, None)
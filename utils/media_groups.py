@@ -0,0 +1,78 @@
+# utils/media_groups.py
+#
+# Сборка альбомов Telegram: фото с общим media_group_id приходят отдельными
+# обновлениями. Обновления альбома копятся, и через MEDIA_GROUP_WAIT секунд
+# после последнего из них весь альбом обрабатывается одним вызовом.
+
+import asyncio
+import logging
+import os
+
+MEDIA_GROUP_WAIT = float(os.getenv("MEDIA_GROUP_WAIT", "1.0"))
+
+# (user_id, media_group_id) -> {"updates": [...], "process": корутина, "timer": Task}
+_groups = {}
+# user_id -> задачи альбомов пользователя (ожидающие и уже обрабатываемые)
+_tasks = {}
+
+
+async def _fire(key, delay: float):
+    await asyncio.sleep(delay)
+    entry = _groups.pop(key, None)
+    if entry is None:
+        return
+    try:
+        await entry["process"](entry["updates"])
+    except Exception as e:
+        logging.exception(f"Ошибка обработки альбома {key}: {e}")
+
+
+def add(user_id, group_id, update, process):
+    """
+    Добавляет обновление в альбом. process(updates) — корутина, которая будет
+    вызвана один раз для всех обновлений альбома (аргументы берутся от первого).
+    """
+    key = (user_id, group_id)
+    entry = _groups.get(key)
+    if entry is None:
+        entry = _groups[key] = {"updates": [], "process": process, "timer": None}
+    else:
+        entry["timer"].cancel()
+    entry["updates"].append(update)
+    _schedule(key, entry, MEDIA_GROUP_WAIT)
+
+
+def _schedule(key, entry: dict, delay: float):
+    task = asyncio.create_task(_fire(key, delay))
+    entry["timer"] = task
+    tasks = _tasks.setdefault(key[0], set())
+    tasks.add(task)
+
+    def _done(t):
+        tasks.discard(t)
+        if not tasks and _tasks.get(key[0]) is tasks:
+            del _tasks[key[0]]
+
+    task.add_done_callback(_done)
+
+
+def _user_entries(user_id) -> list:
+    return [(key, entry) for key, entry in _groups.items() if key[0] == user_id]
+
+
+async def flush(user_id):
+    """Обрабатывает накопленные альбомы пользователя сразу (например, перед /skip) и ждёт их."""
+    for key, entry in _user_entries(user_id):
+        entry["timer"].cancel()
+        _schedule(key, entry, 0)
+    # Заодно дожидаемся альбомов, обработка которых уже идёт
+    tasks = list(_tasks.get(user_id, ()))
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def discard(user_id):
+    """Отбрасывает ещё не обработанные альбомы пользователя."""
+    for key, entry in _user_entries(user_id):
+        entry["timer"].cancel()
+        _groups.pop(key, None)
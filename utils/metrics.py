@@ -0,0 +1,223 @@
+# utils/metrics.py
+#
+# Метрики по этапам конвейера отчёта: счётчики и гистограммы в формате
+# Prometheus (HTTP-эндпоинт METRICS_PORT и/или текстовый файл METRICS_FILE
+# для node_exporter textfile collector) и трассировка по обследованиям —
+# JSON-строки с survey_id в логгер "survey_trace" и, если задан TRACE_DIR,
+# в файл <TRACE_DIR>/<survey_id>.jsonl.
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_FILE = os.getenv("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+
+# Границы гистограмм длительности, секунд: от декодирования фото до долгих GPT-пакетов
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 45, 90, 180)
+
+# Обследование, к которому относятся события текущего контекста
+current_survey = contextvars.ContextVar("metrics_current_survey", default=None)
+
+HELP = {
+    "stage_seconds": "Длительность этапа конвейера отчёта",
+    "stage_errors_total": "Этапы, завершившиеся исключением",
+    "gpt_request_seconds": "Длительность одной попытки запроса к OpenAI",
+    "gpt_queue_wait_seconds": "Ожидание разрешения планировщика GPT",
+    "gpt_scheduler_permits_total": "Разрешения планировщика GPT: выданные (granted) и отклонённые при переполнении (rejected)",
+    "gpt_scheduler_queue_depth": "Запросы, ожидающие разрешения планировщика GPT",
+    "gpt_requests_total": "Попытки запросов к OpenAI по результату",
+    "gpt_tokens_total": "Токены по usage из ответов OpenAI",
+    "gpt_images_total": "Изображения, отправленные в OpenAI",
+    "gpt_parse_events_total": "Результаты разбора структурированных ответов",
+    "analysis_retry_photos_total": "Фото, дозапрошенные после неполного пакетного ответа",
+    "analysis_duplicates_skipped_total": "Фото-дубликаты, не отправленные на анализ",
+    "photo_duplicates_total": "Фото, распознанные как повтор уже отправленных",
+    "photo_rejected_total": "Фото, отклонённые проверкой качества, по причине",
+    "report_producers_skipped_total": "Данные отчёта, не понадобившиеся включённым разделам",
+    "sessions_live": "Активные сессии опроса",
+    "sessions_evicted_total": "Сессии, удалённые по простою (idle) или сверх лимита (limit)",
+    "webhook_updates_total": "Обновления Telegram, принятые webhook, по воркерам",
+    "bytes_total": "Объём данных по этапам",
+    "gpt_cache_events_total": "Обращения к дисковому кэшу GPT: hit, miss, write, eviction",
+    "doc_fields_total": "Поля документов, заполненные локальным OCR или GPT",
+    "doc_gpt_requests_total": "Документы, для которых понадобился (sent) или не понадобился (skipped) GPT",
+    "pictures_total": "Фото, подготовленные для раздела «Фотофиксация»",
+    "report_archive_files_total": "Отчёты, записанные в архив и удалённые из него",
+    "report_archive_pruned_bytes_total": "Объём отчётов, удалённых из архива",
+}
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> значение
+_histograms = {}  # (name, labels) -> [счётчики по BUCKETS..., +Inf, sum]
+_gauges = {}      # name -> функция, возвращающая текущее значение
+_trace_lock = threading.Lock()
+_exporter_started = False
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def total(name: str, **labels) -> float:
+    """Сумма счётчика name по всем меткам (с отбором по labels)."""
+    want = set(_key(name, labels)[1])
+    with _lock:
+        return sum(v for (n, lbl), v in _counters.items() if n == name and want <= set(lbl))
+
+
+def gauge(name: str, fn):
+    """Регистрирует показатель, значение которого fn() берётся в момент выгрузки метрик."""
+    with _lock:
+        _gauges[name] = fn
+
+
+def observe(name: str, value: float, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[i] += 1
+        hist[len(BUCKETS)] += 1
+        hist[-1] += value
+
+
+def trace(event: str, **fields):
+    """Запись трассировки текущего обследования (survey_id из контекста)."""
+    survey_id = current_survey.get()
+    record = {"ts": round(time.time(), 3), "survey_id": survey_id, "event": event, **fields}
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    logging.getLogger("survey_trace").info(line)
+    if TRACE_DIR and survey_id:
+        with _trace_lock:
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            with open(os.path.join(TRACE_DIR, f"{survey_id}.jsonl"), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@contextmanager
+def timer(stage: str, **fields):
+    """Замер этапа: гистограмма stage_seconds{stage} и запись в трассировку обследования."""
+    started = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        elapsed = time.perf_counter() - started
+        inc("stage_errors_total", stage=stage)
+        trace(stage, seconds=round(elapsed, 4), error=repr(e), **fields)
+        raise
+    elapsed = time.perf_counter() - started
+    observe("stage_seconds", elapsed, stage=stage)
+    trace(stage, seconds=round(elapsed, 4), **fields)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        gauges = dict(_gauges)
+    lines = []
+    for name, fn in sorted(gauges.items()):
+        try:
+            value = fn()
+        except Exception as e:
+            logging.warning(f"Метрика {name}: {e!r}")
+            continue
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    for name in sorted({n for n, _ in counters}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f"{name}{_fmt_labels(labels)} {value}")
+    for name in sorted({n for n, _ in histograms}):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), hist in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, count in zip(BUCKETS, hist):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', bound),))} {count}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, (('le', '+Inf'),))} {hist[len(BUCKETS)]}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {hist[-1]}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {hist[len(BUCKETS)]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str = None):
+    """Атомарно записывает метрики в файл (для textfile collector)."""
+    path = path or METRICS_FILE
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _write_loop():
+    while True:
+        time.sleep(METRICS_FILE_INTERVAL)
+        try:
+            write_textfile()
+        except OSError as e:
+            logging.warning(f"Не удалось записать метрики в {METRICS_FILE}: {e}")
+
+
+def start_exporter():
+    """Поднимает /metrics на METRICS_PORT и периодическую запись METRICS_FILE (что задано)."""
+    global _exporter_started
+    with _lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+    if METRICS_PORT:
+        server = ThreadingHTTPServer(("0.0.0.0", METRICS_PORT), _Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        logging.info(f"Метрики Prometheus: http://0.0.0.0:{METRICS_PORT}/metrics")
+    if METRICS_FILE:
+        threading.Thread(target=_write_loop, name="metrics-file", daemon=True).start()
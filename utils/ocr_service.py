@@ -0,0 +1,168 @@
+# utils/ocr_service.py
+#
+# Локальный OCR на EasyOCR в отдельных процессах. Каждый воркер один раз
+# загружает easyocr.Reader; запросы копятся в очереди и уходят воркерам
+# пачками (до OCR_BATCH_SIZE изображений или по истечении OCR_BATCH_WAIT).
+# Импорт модуля не тянет torch и веса модели в вызывающий процесс.
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "1"))
+OCR_LANGS = [lang.strip() for lang in os.getenv("OCR_LANGS", "ru,en").split(",") if lang.strip()]
+OCR_GPU = os.getenv("OCR_GPU", "0") == "1"
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "4"))
+OCR_BATCH_WAIT = float(os.getenv("OCR_BATCH_WAIT", "0.05"))
+
+# --- код процесса-воркера ---
+
+_reader = None
+
+
+def _init_worker(langs, gpu):
+    global _reader
+    import easyocr
+    _reader = easyocr.Reader(langs, gpu=gpu)
+
+
+def _ping() -> bool:
+    return _reader is not None
+
+
+def _read_batch(images: list) -> list:
+    texts = []
+    for image in images:
+        result = _reader.readtext(image, detail=0, paragraph=True)
+        texts.append(" ".join(result))
+    return texts
+
+
+# --- сервис в основном процессе ---
+
+class OCRService:
+    def __init__(self, workers: int = OCR_WORKERS, batch_size: int = OCR_BATCH_SIZE,
+                 batch_wait: float = OCR_BATCH_WAIT):
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+        self._queue = queue.Queue()
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(OCR_LANGS, OCR_GPU)
+        )
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="ocr-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def warm_up(self, timeout: float = None):
+        """Запускает все воркеры и дожидается загрузки модели в каждом (например, при старте бота)."""
+        futures = [self._pool.submit(_ping) for _ in range(self.workers)]
+        for fut in futures:
+            fut.result(timeout=timeout)
+
+    def submit(self, image) -> Future:
+        """Ставит изображение (bytes, путь или numpy-массив) в очередь; Future вернёт распознанный текст."""
+        if self._closed:
+            raise RuntimeError("OCR-сервис остановлен")
+        fut = Future()
+        self._queue.put((image, fut))
+        return fut
+
+    def read_text(self, image, timeout: float = None) -> str:
+        return self.submit(image).result(timeout=timeout)
+
+    def _dispatch(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Добираем пачку, пока не наберётся batch_size или не выйдет время ожидания
+            while len(batch) < self.batch_size:
+                try:
+                    nxt = self._queue.get(timeout=self.batch_wait)
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    self._queue.put(None)
+                    break
+                batch.append(nxt)
+            self._run(batch)
+
+    def _run(self, batch: list):
+        futures = [fut for _, fut in batch if fut.set_running_or_notify_cancel()]
+        images = [image for image, fut in batch if fut in futures]
+        if not images:
+            return
+        try:
+            pool_future = self._pool.submit(_read_batch, images)
+        except Exception as e:
+            for fut in futures:
+                fut.set_exception(e)
+            return
+
+        def _resolve(pf):
+            try:
+                texts = pf.result()
+            except Exception as e:
+                logging.exception(f"Ошибка OCR: {e}")
+                for fut in futures:
+                    fut.set_exception(e)
+                return
+            for fut, text in zip(futures, texts):
+                fut.set_result(text)
+
+        pool_future.add_done_callback(_resolve)
+
+    def shutdown(self):
+        self._closed = True
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._pool.shutdown()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> OCRService:
+    """Общий OCR-сервис процесса; воркеры стартуют при первом обращении."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = OCRService()
+        return _service
+
+
+def set_service(service):
+    """Подменяет общий сервис процесса — например, прокси на сервис в другом процессе (batch_reports)."""
+    global _service
+    with _service_lock:
+        _service = service
+
+
+def read_text(image, timeout: float = None) -> str:
+    return get_service().read_text(image, timeout=timeout)
+
+
+def warm_up_in_background():
+    """Загружает модель в воркерах фоновым потоком, чтобы первый документ не ждал её загрузки."""
+    def _run():
+        try:
+            get_service().warm_up()
+            logging.info("Локальный OCR готов")
+        except Exception as e:
+            logging.warning(f"Локальный OCR не запустился, документы пойдут в GPT: {e!r}")
+
+    threading.Thread(target=_run, name="ocr-warm-up", daemon=True).start()
+
+
+def shutdown():
+    """Останавливает общий сервис, если он запускался."""
+    global _service
+    with _service_lock:
+        service, _service = _service, None
+    if service is not None:
+        service.shutdown()
@@ -0,0 +1,214 @@
+# utils/openai_client.py
+#
+# Единый клиент OpenAI для всех модулей: общий пул HTTP-соединений с
+# keep-alive, таймауты на каждый вызов и повторы с экспоненциальной
+# задержкой и джиттером на 429/5xx и сетевые ошибки.
+# chat_completion — синхронный вызов, achat_completion — асинхронный.
+# Каждая попытка проходит через общий планировщик (utils/gpt_scheduler):
+# лимиты RPM/TPM, приоритет и честная очередь по пользователям.
+# Несколько процессов (batch_reports) делят предел одновременных запросов
+# через общий семафор — set_api_slots().
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from utils import gpt_scheduler, metrics
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_KEEPALIVE = float(os.getenv("OPENAI_KEEPALIVE", "30"))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+_client = None
+_client_lock = threading.Lock()
+# event loop -> AsyncOpenAI: httpx.AsyncClient привязан к своему loop
+_async_clients = weakref.WeakKeyDictionary()
+# Семафор multiprocessing, общий для процессов-воркеров; None — без общего предела
+_api_slots = None
+
+
+def set_api_slots(slots):
+    global _api_slots
+    _api_slots = slots
+
+
+async def _acquire_slot_async():
+    # Семафор другого процесса: не блокируем event loop, опрашиваем
+    while not _api_slots.acquire(block=False):
+        await asyncio.sleep(0.05)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=OPENAI_KEEPALIVE,
+    )
+
+
+def _timeout(total: float = OPENAI_TIMEOUT) -> httpx.Timeout:
+    return httpx.Timeout(total, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def get_client() -> OpenAI:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,  # повторы — в chat_completion
+                timeout=_timeout(),
+                http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+            )
+        return _client
+
+
+def get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    aclient = _async_clients.get(loop)
+    if aclient is None:
+        aclient = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            max_retries=0,
+            timeout=_timeout(),
+            http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+        )
+        _async_clients[loop] = aclient
+    return aclient
+
+
+async def aclose_async_client():
+    """Закрывает клиент текущего event loop (для короткоживущих loop, например asyncio.run)."""
+    aclient = _async_clients.pop(asyncio.get_running_loop(), None)
+    if aclient is not None:
+        await aclient.close()
+
+
+def _should_retry(e: Exception) -> bool:
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code in RETRY_STATUSES
+
+
+def _backoff(attempt: int, e: Exception) -> float:
+    # Если сервер подсказал Retry-After — следуем ему
+    response = getattr(e, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), OPENAI_BACKOFF_MAX)
+            except ValueError:
+                pass
+    # "Full jitter": случайная задержка до экспоненциального потолка
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
+def _used_tokens(resp):
+    usage = getattr(resp, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def _count_images(messages: list) -> int:
+    return sum(
+        1 for msg in messages if isinstance(msg.get("content"), list)
+        for part in msg["content"] if part.get("type") == "image_url"
+    )
+
+
+def _record(model: str, images: int, started: float, waited: float, resp=None, error: Exception = None):
+    # Метрики и трассировка одной попытки запроса
+    elapsed = time.perf_counter() - started
+    if error is None:
+        status = "ok"
+    else:
+        status = str(getattr(error, "status_code", None) or type(error).__name__)
+    metrics.observe("gpt_request_seconds", elapsed, model=model)
+    metrics.observe("gpt_queue_wait_seconds", waited)
+    metrics.inc("gpt_requests_total", model=model, status=status)
+    metrics.inc("gpt_images_total", images, model=model)
+    usage = getattr(resp, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    metrics.inc("gpt_tokens_total", prompt_tokens, model=model, kind="prompt")
+    metrics.inc("gpt_tokens_total", completion_tokens, model=model, kind="completion")
+    metrics.trace(
+        "gpt_call", model=model, status=status, seconds=round(elapsed, 4), queue_wait=round(waited, 4),
+        images=images, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+    )
+
+
+def chat_completion(timeout: float = OPENAI_TIMEOUT, priority: int = gpt_scheduler.BULK, **kwargs):
+    """client.chat.completions.create с общим пулом соединений, таймаутом и повторами."""
+    client = get_client()
+    scheduler = gpt_scheduler.get_scheduler()
+    est = gpt_scheduler.estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
+    user_id = gpt_scheduler.current_user.get()
+    model, images = kwargs.get("model", ""), _count_images(kwargs.get("messages", []))
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        ticket = scheduler.acquire(priority, user_id, est)
+        if _api_slots is not None:
+            _api_slots.acquire()
+        started = time.perf_counter()
+        try:
+            try:
+                resp = client.chat.completions.create(timeout=_timeout(timeout), **kwargs)
+            finally:
+                if _api_slots is not None:
+                    _api_slots.release()
+            scheduler.release(ticket, _used_tokens(resp))
+            _record(model, images, started, started - queued, resp=resp)
+            return resp
+        except Exception as e:
+            _record(model, images, started, started - queued, error=e)
+            if attempt >= OPENAI_MAX_RETRIES or not _should_retry(e):
+                raise
+            delay = _backoff(attempt, e)
+            logging.warning(f"OpenAI: {e!r}, повтор {attempt + 1}/{OPENAI_MAX_RETRIES} через {delay:.1f} с")
+            time.sleep(delay)
+
+
+async def achat_completion(timeout: float = OPENAI_TIMEOUT, priority: int = gpt_scheduler.BULK, **kwargs):
+    """Асинхронный вариант chat_completion."""
+    aclient = get_async_client()
+    scheduler = gpt_scheduler.get_scheduler()
+    est = gpt_scheduler.estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens", 0))
+    user_id = gpt_scheduler.current_user.get()
+    model, images = kwargs.get("model", ""), _count_images(kwargs.get("messages", []))
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        queued = time.perf_counter()
+        ticket = await scheduler.acquire_async(priority, user_id, est)
+        if _api_slots is not None:
+            await _acquire_slot_async()
+        started = time.perf_counter()
+        try:
+            try:
+                resp = await aclient.chat.completions.create(timeout=_timeout(timeout), **kwargs)
+            finally:
+                if _api_slots is not None:
+                    _api_slots.release()
+            scheduler.release(ticket, _used_tokens(resp))
+            _record(model, images, started, started - queued, resp=resp)
+            return resp
+        except Exception as e:
+            _record(model, images, started, started - queued, error=e)
+            if attempt >= OPENAI_MAX_RETRIES or not _should_retry(e):
+                raise
+            delay = _backoff(attempt, e)
+            logging.warning(f"OpenAI: {e!r}, повтор {attempt + 1}/{OPENAI_MAX_RETRIES} через {delay:.1f} с")
+            await asyncio.sleep(delay)
@@ -0,0 +1,70 @@
+# utils/photo_hash.py
+#
+# Перцептивные хэши фото на NumPy для поиска почти одинаковых снимков
+# (повторная отправка, пересланное и пережатое фото). 64-битный dHash или
+# pHash (PHOTO_HASH); фото считаются дубликатами, если расстояние Хэмминга
+# между хэшами не больше PHOTO_DUP_DISTANCE.
+
+import os
+from functools import lru_cache
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+PHOTO_HASH = os.getenv("PHOTO_HASH", "dhash")
+PHOTO_DUP_DISTANCE = int(os.getenv("PHOTO_DUP_DISTANCE", "6"))
+
+
+def _gray(data: bytes, width: int, height: int) -> np.ndarray:
+    with Image.open(BytesIO(data)) as img:
+        # JPEG декодируется сразу в уменьшенном масштабе — хэшу полное разрешение не нужно
+        img.draft("L", (width * 8, height * 8))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img = img.resize((width, height), Image.LANCZOS)
+    return np.asarray(img, dtype=np.float32)
+
+
+def _pack(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def dhash(data: bytes) -> int:
+    """Разностный хэш: знак перепада яркости между соседними пикселями 9x8."""
+    g = _gray(data, 9, 8)
+    return _pack(g[:, 1:] > g[:, :-1])
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    m[0] /= np.sqrt(2)
+    return m
+
+
+def phash(data: bytes) -> int:
+    """DCT-хэш: низкие частоты 8x8 изображения 32x32 относительно их медианы."""
+    d = _dct_matrix(32)
+    low = (d @ _gray(data, 32, 32) @ d.T)[:8, :8]
+    return _pack(low > np.median(low.ravel()[1:]))
+
+
+def compute(data: bytes) -> str:
+    """Хэш фото в hex (строкой — чтобы хранить в данных сессии)."""
+    h = phash(data) if PHOTO_HASH == "phash" else dhash(data)
+    return f"{h:016x}"
+
+
+def distance(a: str, b: str) -> int:
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+def find_twin(h: str, known: dict, max_distance: int = PHOTO_DUP_DISTANCE):
+    """Ссылка на самое похожее из known {ref: хэш} фото в пределах max_distance, иначе None."""
+    best, best_ref = max_distance + 1, None
+    for ref, other in known.items():
+        d = distance(h, other)
+        if d < best:
+            best, best_ref = d, ref
+    return best_ref
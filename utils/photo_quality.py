@@ -0,0 +1,93 @@
+# utils/photo_quality.py
+#
+# Быстрая локальная проверка качества фото при загрузке: резкость (дисперсия
+# лапласиана), экспозиция (средняя яркость и доля пере/недосвеченных пикселей)
+# и разрешение. Считается на уменьшенном кадре за миллисекунды; фото, не
+# прошедшее проверку, просим переснять и в GPT-анализ не отправляем.
+# Проверяются только фото конструктивных элементов, не документы.
+
+import os
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+PHOTO_QUALITY = os.getenv("PHOTO_QUALITY", "1") != "0"
+# Длинная сторона кадра, на котором считаются метрики (пороги резкости — для этого размера)
+QUALITY_FRAME = int(os.getenv("QUALITY_FRAME", "512"))
+PHOTO_MIN_SHARPNESS = float(os.getenv("PHOTO_MIN_SHARPNESS", "40"))
+PHOTO_MIN_BRIGHTNESS = float(os.getenv("PHOTO_MIN_BRIGHTNESS", "40"))
+PHOTO_MAX_BRIGHTNESS = float(os.getenv("PHOTO_MAX_BRIGHTNESS", "225"))
+# Предельная доля почти чёрных / почти белых пикселей
+PHOTO_MAX_CLIPPED = float(os.getenv("PHOTO_MAX_CLIPPED", "0.5"))
+PHOTO_MIN_SIDE = int(os.getenv("PHOTO_MIN_SIDE", "480"))
+
+# Причина отказа -> текст для пользователя
+REASONS = {
+    "blurry": "размыто",
+    "dark": "слишком темно",
+    "bright": "пересвечено",
+    "small": "слишком маленькое разрешение",
+    "unreadable": "не удалось открыть изображение",
+}
+
+# Во сколько раз JPEG уменьшается прямо при декодировании
+_REDUCED = {8: cv2.IMREAD_REDUCED_GRAYSCALE_8, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+            2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 1: cv2.IMREAD_GRAYSCALE}
+
+
+def _frame(data: bytes, width: int, height: int) -> np.ndarray:
+    # Наибольшее уменьшение при декодировании, после которого кадр ещё не меньше QUALITY_FRAME
+    factor = next(f for f in _REDUCED if f == 1 or max(width, height) // f >= QUALITY_FRAME)
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED[factor])
+    if gray is None:
+        return None
+    scale = QUALITY_FRAME / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def assess(data: bytes) -> dict:
+    """
+    Метрики качества фото и список причин отказа ("problems", ключи REASONS).
+    Пустой список — фото годится для анализа.
+    """
+    try:
+        with Image.open(BytesIO(data)) as img:
+            width, height = img.size  # только заголовок, без декодирования
+        gray = _frame(bytes(data), width, height)
+    except Exception:
+        gray = None
+    if gray is None:
+        return {"problems": ["unreadable"]}
+
+    brightness = float(gray.mean())
+    dark = float(np.count_nonzero(gray < 16)) / gray.size
+    bright = float(np.count_nonzero(gray > 240)) / gray.size
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    problems = []
+    if min(width, height) < PHOTO_MIN_SIDE:
+        problems.append("small")
+    if brightness < PHOTO_MIN_BRIGHTNESS or dark > PHOTO_MAX_CLIPPED:
+        problems.append("dark")
+    elif brightness > PHOTO_MAX_BRIGHTNESS or bright > PHOTO_MAX_CLIPPED:
+        problems.append("bright")
+    elif sharpness < PHOTO_MIN_SHARPNESS:
+        # Резкость тёмного или пересвеченного кадра занижена — её проверяем только при нормальной экспозиции
+        problems.append("blurry")
+    return {
+        "problems": problems,
+        "width": width,
+        "height": height,
+        "sharpness": round(sharpness, 1),
+        "brightness": round(brightness, 1),
+        "dark": round(dark, 3),
+        "bright": round(bright, 3),
+    }
+
+
+def describe(problems: list) -> str:
+    return ", ".join(REASONS[p] for p in problems)
@@ -0,0 +1,140 @@
+# utils/photo_store.py
+#
+# Хранилище загруженных фото. Фото держатся в памяти и передаются
+# по строковой ссылке "mem:<id>"; при превышении PHOTO_MEMORY_BUDGET
+# новые фото сбрасываются на диск, и ссылкой становится путь к файлу.
+# Обычные пути к файлам принимаются всеми функциями наравне с mem-ссылками.
+
+import logging
+import os
+import threading
+import time
+import uuid
+from io import BytesIO
+
+PHOTO_MEMORY_BUDGET = int(os.getenv("PHOTO_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+PHOTO_SPILL_DIR = os.getenv("PHOTO_SPILL_DIR", "temp")
+
+MEM_PREFIX = "mem:"
+
+_buffers = {}
+_spilled = set()
+_lock = threading.Lock()
+_mem_bytes = 0
+
+
+def is_mem(ref: str) -> bool:
+    return isinstance(ref, str) and ref.startswith(MEM_PREFIX)
+
+
+def put(data: bytes, name: str = None, persistent: bool = False) -> str:
+    """
+    Сохраняет фото и возвращает ссылку на него.
+    persistent=True — сразу на диск (ссылка должна пережить перезапуск или
+    читаться другим процессом, например при SQLite-хранилище сессий).
+    """
+    global _mem_bytes
+    data = bytes(data)
+    with _lock:
+        if not persistent and _mem_bytes + len(data) <= PHOTO_MEMORY_BUDGET:
+            ref = f"{MEM_PREFIX}{uuid.uuid4().hex}"
+            _buffers[ref] = data
+            _mem_bytes += len(data)
+            return ref
+
+    # Бюджет памяти исчерпан (или нужна персистентность) — пишем на диск
+    os.makedirs(PHOTO_SPILL_DIR, exist_ok=True)
+    path = os.path.join(PHOTO_SPILL_DIR, f"{uuid.uuid4().hex[:8]}_{name or 'photo.jpg'}")
+    with open(path, "wb") as f:
+        f.write(data)
+    with _lock:
+        _spilled.add(path)
+    logging.info(f"Фото сброшено на диск: {path} ({len(data)} байт)")
+    return path
+
+
+def read(ref: str) -> bytes:
+    if is_mem(ref):
+        with _lock:
+            data = _buffers.get(ref)
+        if data is None:
+            raise FileNotFoundError(ref)
+        return data
+    with open(ref, "rb") as f:
+        return f.read()
+
+
+def source(ref: str):
+    """Объект для PIL/python-docx: BytesIO для фото в памяти, путь — для файла."""
+    if is_mem(ref):
+        return BytesIO(read(ref))
+    return ref
+
+
+def exists(ref) -> bool:
+    if not ref:
+        return False
+    if is_mem(ref):
+        with _lock:
+            return ref in _buffers
+    return os.path.exists(ref)
+
+
+def version(ref: str):
+    """Признак неизменности содержимого — для ключей мемоизации."""
+    if is_mem(ref):
+        return ref
+    st = os.stat(ref)
+    return (ref, st.st_mtime_ns, st.st_size)
+
+
+def release(refs):
+    """Освобождает фото: буферы в памяти и файлы, сброшенные на диск этим модулем."""
+    global _mem_bytes
+    for ref in refs:
+        if is_mem(ref):
+            with _lock:
+                data = _buffers.pop(ref, None)
+                if data is not None:
+                    _mem_bytes -= len(data)
+            continue
+        with _lock:
+            owned = ref in _spilled
+            _spilled.discard(ref)
+        # Файлы, записанные другим процессом или до перезапуска, тоже лежат в PHOTO_SPILL_DIR
+        if owned or os.path.dirname(os.path.abspath(ref)) == os.path.abspath(PHOTO_SPILL_DIR):
+            try:
+                os.remove(ref)
+            except FileNotFoundError:
+                pass
+
+
+def remove_stale(max_age: float, keep=()) -> int:
+    """
+    Удаляет из PHOTO_SPILL_DIR файлы старше max_age секунд, кроме keep —
+    например, оставшиеся от сессий до перезапуска. Возвращает число удалённых.
+    """
+    keep = {os.path.abspath(ref) for ref in keep if not is_mem(ref)}
+    cutoff = time.time() - max_age
+    removed = 0
+    try:
+        names = os.listdir(PHOTO_SPILL_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        path = os.path.abspath(os.path.join(PHOTO_SPILL_DIR, name))
+        try:
+            if path in keep or os.stat(path).st_mtime >= cutoff:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        with _lock:
+            _spilled.discard(os.path.join(PHOTO_SPILL_DIR, name))
+        removed += 1
+    return removed
+
+
+def usage() -> dict:
+    with _lock:
+        return {"memory_bytes": _mem_bytes, "memory_photos": len(_buffers), "spilled_photos": len(_spilled)}
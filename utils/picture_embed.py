@@ -0,0 +1,86 @@
+# utils/picture_embed.py
+#
+# Подготовка фото для раздела «Фотофиксация». В документе фото показывается
+# шириной 5.5 дюйма, поэтому исходник пересжимается до PICTURE_DPI на эту
+# ширину. Пересжатие идёт параллельно в пуле процессов.
+
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from utils import metrics, photo_store
+
+PICTURE_DPI = int(os.getenv("PICTURE_DPI", "150"))
+PICTURE_JPEG_QUALITY = int(os.getenv("PICTURE_JPEG_QUALITY", "80"))
+PICTURE_WORKERS = int(os.getenv("PICTURE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PICTURE_WORKERS)
+        return _pool
+
+
+def shutdown():
+    """Останавливает пул пересжатия (процесс, заводивший пул, иначе ждёт его воркеров при выходе)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def resample(data: bytes, max_width: int, quality: int = PICTURE_JPEG_QUALITY) -> bytes:
+    """JPEG шириной не больше max_width пикселей; подходящий JPEG возвращается без изменений."""
+    with Image.open(BytesIO(data)) as img:
+        if img.format == "JPEG" and img.width <= max_width:
+            return data
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        if img.width > max_width:
+            height = max(1, round(img.height * max_width / img.width))
+            img = img.resize((max_width, height), Image.LANCZOS)
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+        out = buf.getvalue()
+    # Пересжатие не должно раздувать и без того компактный файл
+    return out if len(out) < len(data) else data
+
+
+def prepare_pictures(refs: list, width_in: float) -> list:
+    """
+    Для каждой ссылки на фото — BytesIO с пересжатым JPEG (None, если фото нет).
+    Порядок результата совпадает с refs.
+    """
+    max_width = max(1, int(width_in * PICTURE_DPI))
+    datas = [photo_store.read(ref) if photo_store.exists(ref) else None for ref in refs]
+    jobs = [(i, d) for i, d in enumerate(datas) if d is not None]
+
+    if len(jobs) > 1 and PICTURE_WORKERS > 1:
+        pool = _get_pool()
+        outs = list(pool.map(resample, [d for _, d in jobs], [max_width] * len(jobs)))
+    else:
+        outs = [resample(d, max_width) for _, d in jobs]
+
+    result = [None] * len(refs)
+    bytes_in = bytes_out = 0
+    for (i, data), out in zip(jobs, outs):
+        result[i] = BytesIO(out)
+        bytes_in += len(data)
+        bytes_out += len(out)
+
+    metrics.inc("pictures_total", len(jobs))
+    metrics.inc("bytes_total", bytes_in, stage="picture_in")
+    metrics.inc("bytes_total", bytes_out, stage="picture_out")
+    logging.info(f"Фотофиксация: {len(jobs)} фото, {bytes_in} -> {bytes_out} байт")
+    return result
@@ -0,0 +1,97 @@
+# utils/report_delivery.py
+#
+# Выдача готового заключения: документ сериализуется в память и уходит в
+# Telegram прямо из буфера. Копия на диске (архив) — по желанию: уникальные
+# имена, атомарная запись, ограничение архива по суммарному размеру и
+# возрасту файлов, не больше REPORT_ARCHIVE_WRITERS одновременных записей.
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from io import BytesIO
+
+from utils import metrics
+
+REPORT_ARCHIVE = os.getenv("REPORT_ARCHIVE", "1") != "0"
+REPORT_ARCHIVE_DIR = os.getenv("REPORT_ARCHIVE_DIR", "output")
+REPORT_ARCHIVE_MAX_BYTES = int(os.getenv("REPORT_ARCHIVE_MAX_BYTES", str(500 * 1024 * 1024)))
+REPORT_ARCHIVE_MAX_AGE = float(os.getenv("REPORT_ARCHIVE_MAX_AGE", str(30 * 24 * 3600)))
+REPORT_ARCHIVE_WRITERS = int(os.getenv("REPORT_ARCHIVE_WRITERS", "2"))
+
+_writers = threading.BoundedSemaphore(max(1, REPORT_ARCHIVE_WRITERS))
+_prune_lock = threading.Lock()
+
+
+def report_name() -> str:
+    """Имя файла заключения; суффикс исключает совпадения у отчётов одной секунды."""
+    return f"zaklyuchenie_{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}.docx"
+
+
+def serialize(doc, name: str = None) -> BytesIO:
+    """Документ python-docx в буфере; name становится именем файла при отправке."""
+    buf = BytesIO()
+    doc.save(buf)
+    buf.seek(0)
+    buf.name = name or report_name()
+    return buf
+
+
+def archive(report: BytesIO) -> str:
+    """Сохраняет копию отчёта в архив (если включён). Возвращает путь или None."""
+    if not REPORT_ARCHIVE:
+        return None
+    os.makedirs(REPORT_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(REPORT_ARCHIVE_DIR, report.name)
+    tmp = f"{path}.tmp"
+    with _writers:
+        with open(tmp, "wb") as f:
+            f.write(report.getbuffer())
+        os.replace(tmp, path)
+    metrics.inc("report_archive_files_total", event="written")
+    prune()
+    return path
+
+
+def prune():
+    """Удаляет устаревшие отчёты, затем самые старые — пока архив больше REPORT_ARCHIVE_MAX_BYTES."""
+    if not _prune_lock.acquire(blocking=False):
+        return  # чистка уже идёт в другом потоке
+    try:
+        entries = []
+        try:
+            names = os.listdir(REPORT_ARCHIVE_DIR)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".docx"):
+                continue
+            path = os.path.join(REPORT_ARCHIVE_DIR, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - REPORT_ARCHIVE_MAX_AGE
+        removed = removed_bytes = 0
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= REPORT_ARCHIVE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            removed_bytes += size
+        if removed:
+            metrics.inc("report_archive_files_total", removed, event="pruned")
+            metrics.inc("report_archive_pruned_bytes_total", removed_bytes)
+            logging.info(f"Архив отчётов: удалено {removed} файлов ({removed_bytes} байт)")
+    finally:
+        _prune_lock.release()
@@ -0,0 +1,81 @@
+# utils/report_sections.py
+#
+# Разделы отчёта как граф ленивых производителей данных. Раздел объявляет,
+# какие данные ему нужны (requires), производитель — от каких данных зависит
+# сам. При сборке запускаются только производители, нужные включённым
+# разделам (REPORT_SECTIONS), остальные пропускаются и попадают в лог.
+
+import logging
+import os
+
+from utils import metrics
+
+# Разделы отчёта по порядку; "conclusions" (выводы GPT) по умолчанию выключен
+REPORT_SECTIONS = [
+    s.strip() for s in os.getenv("REPORT_SECTIONS", "element_notes,photos,closing").split(",") if s.strip()
+]
+
+
+class SectionGraph:
+    def __init__(self):
+        self.producers = {}  # имя -> (requires, fn(ctx))
+        self.sections = {}   # имя -> (requires, fn(doc, ctx)); порядок объявления = порядок в отчёте
+
+    def producer(self, name: str, requires: tuple = ()):
+        def register(fn):
+            self.producers[name] = (tuple(requires), fn)
+            return fn
+        return register
+
+    def section(self, name: str, requires: tuple = ()):
+        def register(fn):
+            self.sections[name] = (tuple(requires), fn)
+            return fn
+        return register
+
+    def needed(self, sections: list) -> set:
+        """Производители, транзитивно нужные разделам sections."""
+        needed, stack = set(), [p for s in sections for p in self.sections[s][0]]
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(self.producers[name][0])
+        return needed
+
+    def render(self, doc, ctx: "SectionContext", enabled: list = None) -> list:
+        """Добавляет в doc включённые разделы (в порядке объявления). Возвращает их список."""
+        enabled = REPORT_SECTIONS if enabled is None else enabled
+        unknown = [s for s in enabled if s not in self.sections]
+        if unknown:
+            logging.warning(f"Неизвестные разделы отчёта {unknown}, пропущены")
+        sections = [s for s in self.sections if s in enabled]
+
+        skipped = sorted(set(self.producers) - self.needed(sections))
+        if skipped:
+            logging.info(f"Отчёт: не нужны разделам {sections}, не запускаются: {skipped}")
+            for name in skipped:
+                metrics.inc("report_producers_skipped_total", producer=name)
+
+        ctx.graph = self
+        for name in sections:
+            self.sections[name][1](doc, ctx)
+        return sections
+
+
+class SectionContext:
+    """Входные данные отчёта и кэш уже посчитанных производителей."""
+
+    def __init__(self, **inputs):
+        self.__dict__.update(inputs)
+        self.graph = None
+        self._values = {}
+
+    def get(self, name: str):
+        if name not in self._values:
+            requires, fn = self.graph.producers[name]
+            for dep in requires:
+                self.get(dep)
+            with metrics.timer(name):
+                self._values[name] = fn(self)
+        return self._values[name]
@@ -0,0 +1,258 @@
+# utils/report_template.py
+#
+# Заготовка заключения. Статический текст (аккредитация, аттестаты экспертов,
+# перечень работ, общие выводы, подписи) собирается один раз: из готового
+# файла REPORT_TEMPLATE или через build_skeleton(). Для каждого отчёта
+# копируется закэшированный XML и подставляются значения {{...}}.
+# Плейсхолдер должен целиком лежать в одном run — при правке шаблона в Word
+# вводите его одним куском.
+
+import copy
+import os
+import re
+import sys
+import threading
+from io import BytesIO
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.shared import Inches
+
+REPORT_TEMPLATE = os.getenv(
+    "REPORT_TEMPLATE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "report_skeleton.docx"),
+)
+# Абзац-метка: на его место вставляются динамические разделы (фотофиксация и т.п.)
+DYNAMIC_MARKER = "{{DYNAMIC}}"
+# Абзац-метка перед подписями: между общими выводами и подписями встают выводы GPT.
+# В заготовке без неё подписи остаются частью общих выводов
+SIGNATURES_MARKER = "{{SIGNATURES}}"
+
+_PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+
+_cache = None
+_lock = threading.Lock()
+
+
+def _add_header(doc):
+    # — Шапка с логотипом
+    section = doc.sections[0]
+    header = section.header
+    logo = os.path.join(os.getcwd(), "logo.png")
+    hdr = header.add_paragraph()
+    if os.path.exists(logo):
+        run = hdr.add_run()
+        run.add_picture(logo, width=Inches(1.0))
+    text_run = hdr.add_run("\nТЕХНИЧЕСКОЕ ЗАКЛЮЧЕНИЕ № QAZ-__/__-__")
+    text_run.bold = True
+    hdr.alignment = 1
+
+
+def _add_front(doc):
+    # — Реквизиты
+    p = doc.add_paragraph()
+    p.add_run("Специализированная организация").bold = True
+    p.add_run(" – ТОО «Qazlife», БИН 171140033560,")
+    p.add_run(" свидетельство об аккредитации №").bold = True
+    p.add_run(" KZ23VWC00067014 от 09 апреля 2024 года, на право осуществления экспертных работ по техническому обследованию надежности и устойчивости зданий и сооружений на технически и технологически сложных объектах первого и второго уровней ответственности,")
+    p.add_run(" в лице экспертов").bold = True
+    p.add_run(" – Капас Асет Саулебекулы и Жалғасбай Қалдыбек Рысбекұлы, ")
+    p = doc.add_paragraph()
+    p.add_run("аттестат эксперта").bold = True
+    p.add_run(" – Капас Асет Саулебекулы № KZ14VJE00052616; по экспертным работам и инжиниринговым услугам с правом осуществления этой деятельности: по виду: Техническое обследование надежности и устойчивости зданий и сооружений")
+    p = doc.add_paragraph()
+    p.add_run("дата выдачи").bold = True
+    p.add_run(" – 04.02.2020 года.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("аттестат эксперта").bold = True
+    paragraph.add_run(" – Жалғасбай Қалдыбек Рысбекұлы № KZ13VJE00050985 по экспертным работам и инжиниринговым услугам с правом осуществления этой деятельности: по виду: Техническое обследование надежности и устойчивости зданий и сооружений")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("дата выдачи").bold = True
+    paragraph.add_run(" – 25.11.2019 года.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    Инженер по обследованию").bold = True
+    paragraph.add_run(" – Кірбасов Еркебұлан Рүстемұлы.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("Произвели:").bold = True
+    paragraph.add_run(" техническое обследование надежности и устойчивости объекта по адресу: {{address}}")
+
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("Причина обследования").bold = True
+    paragraph.add_run(" – обращение заявителя {{fio}}.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("Перечень выполненных работ:").bold = True
+    doc.add_paragraph("Обследование объекта с оценкой при необходимости живучести производился специализированной организацией, имеющей аттестованных экспертов по техническому обследованию надежности и устойчивости зданий и сооружений.")
+    doc.add_paragraph("    Обследование объекта состоит из этапов:")
+    doc.add_paragraph("    - подготовки к проведению обследования;")
+    doc.add_paragraph("    - предварительного визуального и полного (детального инструментального) обследования;")
+    doc.add_paragraph("    - сплошное визуальное обследование конструкции жилого дома;")
+    doc.add_paragraph("    - выявление дефектов и повреждений конструкций с фотофиксацией;")
+    doc.add_paragraph("    - определение конструктивного решения;")
+    doc.add_paragraph("    - оценки технического состояния и (при необходимости) живучести объекта на аварийное воздействие.")
+    doc.add_paragraph("    - составление технического отчета с выводами о техническом состоянии и рекомендациями по дальнейшей эксплуатации.")
+    doc.add_paragraph("    На этапе подготовки к проведению обследования выполнены работы по:")
+    doc.add_paragraph("    – ознакомлению с объектом обследования, его объемно-планировочным и конструктивным решением;")
+    doc.add_paragraph("    На этапе предварительного визуального и полного (детального инструментального) обследования произведена предварительная оценка технического состояния строительных конструкций по внешним признакам для определения необходимости в проведении детального инструментального обследования.")
+    doc.add_paragraph("    Предварительную оценку технического состояния строительных конструкций и инженерных систем по внешним признакам следует производить для оперативного выявления явно аварийных участков и своевременного выполнения страховочных мероприятий.")
+    doc.add_paragraph("    Если в процессе предварительного обследования будут обнаружены дефекты и повреждения, снижающие прочность, устойчивость и жесткость несущих конструкций, или приводящие к неисправности инженерных систем, то необходимо перейти к детальному инструментальному обследованию.")
+
+    doc.add_heading("    Строительные конструкции:", level=1)
+    doc.add_paragraph("    Год постройки – {{build_year}}")
+    doc.add_paragraph("    Фундамент – ")
+    doc.add_paragraph("    Стены – ")
+    doc.add_paragraph("    Покрытия – ")
+    doc.add_paragraph("    Покрытие пола – ")
+    doc.add_paragraph("    Дверные и оконные блоки – ")
+    doc.add_paragraph("    Покрытие кровли – ")
+    doc.add_paragraph("    Инженерные сети – ")
+
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    Все конструкции находятся ")
+    paragraph.add_run("в аварийном неудовлетворительном ").bold = True
+    paragraph.add_run("техническом состоянии.")
+
+    doc.add_paragraph("Заказчик: {{fio}}")
+    doc.add_paragraph("Удостоверение личности: {{id_number}} от {{id_date}}")
+    doc.add_paragraph("Адрес объекта: {{address}}")
+    doc.add_paragraph("Кадастровый номер: {{cadastral_number}}")
+    doc.add_paragraph("Год постройки: {{build_year}}")
+    doc.add_paragraph("Назначение: {{purpose}}")
+
+
+def _add_closing(doc):
+    doc.add_heading("Общие выводы:", level=1)
+
+    doc.add_paragraph("    Согласно результатом обследование строительных конструкций, выявлено следущее:")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    - Фундаменты соответствуют категории – ")
+    paragraph.add_run("{{foundation_state}}").bold = True
+    paragraph.add_run(" существуют повреждения, свидетельствующие о возможности обрушения конструкции. Требуется немедленная разгрузка конструкций;")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    - Стены соответствуют категории – ")
+    paragraph.add_run("{{walls_state}}").bold = True
+    paragraph.add_run(" полное повреждение. Снижение несущей способности до 50%. В конструкциях наблюдаются деформации и дефекты, свидетельствующие о потере ими несущей способности. Состояние конструкций аварийное. Возникает угроза обрушения. Необходимо запретить эксплуатацию аварийных конструкций, прекратить технологический процесс и немедленно удалить людей из опасных зон. Конструкция подлежит разборке;")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    - Фасад соответствуют категории – ")
+    paragraph.add_run("{{facade_state}}").bold = True
+    paragraph.add_run(" существуют повреждения, свидетельствующие о возможности обрушения конструкции. Требуется немедленная разгрузка конструкций;")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    - Дверные и оконные блоки соответствуют категории – ")
+    paragraph.add_run("{{windows_state}}").bold = True
+    paragraph.add_run(" техническому состоянию;")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    - Покрытия кровли соответствуют категории – ")
+    paragraph.add_run("{{roof_state}}").bold = True
+    paragraph.add_run(" техническому состоянию.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    Детальное обследование показало, что на объекте ")
+    paragraph.add_run("существуют повреждения, свидетельствующие о возможности обрушения конструкции.").bold = True
+    paragraph = doc.add_paragraph()
+    paragraph.add_run(" Согласно п. 4.3.2, СП РК 1.04-101-2012, объект по вышеуказанному адресу, соответствует — ")
+    paragraph.add_run("на грани обрушения,").bold = True
+    paragraph.add_run(" характеризуется повреждениями и деформациями, свидетельствующими об исчерпании несущей способности и опасности обрушения (необходимо проведение срочных страховочных мероприятий).")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    В конструкциях наблюдаются деформации и дефекты, свидетельствующие о потере ими несущей способности. Состояние конструкций ")
+    paragraph.add_run("аварийное.").bold = True
+    paragraph.add_run(" Возникает угроза обрушения. Необходимо запретить эксплуатацию аварийных конструкций, прекратить технологический процесс и немедленно удалить людей из опасных зон. Конструкция подлежит разборке.")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("    Объект обследования по адресу: {{address}} ")
+    paragraph.add_run("не может быть допущен к эксплуатации,").bold = True
+    paragraph.add_run(" на установленных параметрах. Необходимо ")
+    paragraph.add_run("произвести снос здания.").bold = True
+
+
+def _add_signatures(doc):
+    # — Подписи экспертов
+    doc.add_paragraph("   Инженер‑эксперт Капас А.С.")
+    doc.add_paragraph("   (Аттестат № KZ14VJE00052616 ")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("   от 04.02.2020 г.)         __________________________")
+    paragraph.add_run("Капас А.С").bold = True
+    doc.add_paragraph("   Инженер‑эксперт Жалғасбай Қ.Р.")
+    doc.add_paragraph("   (Аттестат № KZ13VJE00050985 ")
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("   от 25.11.2019 г.)         __________________________")
+    paragraph.add_run("Жалғасбай Қ.Р").bold = True
+    paragraph = doc.add_paragraph()
+    paragraph.add_run("   Инженер по обследованию         __________________________")
+    paragraph.add_run("Кірбасов Е.Р.").bold = True
+
+
+def build_skeleton() -> Document:
+    """Собирает заготовку через python-docx: статический текст с плейсхолдерами и меткой DYNAMIC_MARKER."""
+    doc = Document()
+    _add_header(doc)
+    _add_front(doc)
+    doc.add_paragraph(DYNAMIC_MARKER)
+    _add_closing(doc)
+    doc.add_paragraph(SIGNATURES_MARKER)
+    _add_signatures(doc)
+    return doc
+
+
+def _text(el) -> str:
+    return "".join(t.text or "" for t in el.iter(qn("w:t")))
+
+
+def load(path: str = REPORT_TEMPLATE):
+    """Загружает заготовку и кэширует её XML. Достаточно одного вызова на процесс."""
+    global _cache
+    doc = Document(path) if os.path.exists(path) else build_skeleton()
+
+    body = doc.element.body
+    blocks = [el for el in body if el.tag != qn("w:sectPr")]
+    texts = [_text(el).strip() for el in blocks]
+    marker = texts.index(DYNAMIC_MARKER)
+    signatures = texts.index(SIGNATURES_MARKER) if SIGNATURES_MARKER in texts[marker:] else len(blocks)
+    for el in blocks:
+        body.remove(el)
+
+    # Пустой документ с шапкой, стилями и логотипом — основа каждого отчёта
+    buf = BytesIO()
+    doc.save(buf)
+    _cache = {"base": buf.getvalue(), "front": blocks[:marker],
+              "closing": blocks[marker + 1:signatures], "signatures": blocks[signatures + 1:]}
+    return _cache
+
+
+def _template() -> dict:
+    if _cache is None:
+        with _lock:
+            if _cache is None:
+                load()
+    return _cache
+
+
+def _append(doc, elements, values: dict):
+    body = doc.element.body
+    for el in elements:
+        el = copy.deepcopy(el)
+        for t in el.iter(qn("w:t")):
+            if t.text and "{{" in t.text:
+                t.text = _PLACEHOLDER.sub(lambda m: str(values.get(m.group(1), m.group(0))), t.text)
+        body.insert_element_before(el, "w:sectPr")
+
+
+def new_document(values: dict) -> Document:
+    """Новый отчёт: шапка и реквизиты с подставленными values."""
+    doc = Document(BytesIO(_template()["base"]))
+    _append(doc, _template()["front"], values)
+    return doc
+
+
+def append_closing(doc, values: dict):
+    """Дописывает общие выводы."""
+    _append(doc, _template()["closing"], values)
+
+
+def append_signatures(doc, values: dict):
+    """Дописывает подписи экспертов."""
+    _append(doc, _template()["signatures"], values)
+
+
+if __name__ == "__main__":
+    # python -m utils.report_template templates/report_skeleton.docx
+    out = sys.argv[1] if len(sys.argv) > 1 else REPORT_TEMPLATE
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    build_skeleton().save(out)
+    print(out)
@@ -0,0 +1,296 @@
+# utils/session_store.py
+#
+# Хранилище состояния диалога (шаг + собранные данные) вместо глобальных
+# dict в handlers/collector. Два бэкенда:
+#   - MemorySessionStore — в памяти процесса (как раньше);
+#   - SQLiteSessionStore — SQLite в режиме WAL, одна строка на сессию
+#     (фото, поля, хэши и дубликаты — отдельными столбцами); переживает
+#     перезапуск и допускает несколько процессов бота.
+# Выбор: SESSION_STORE=memory|sqlite, путь к базе — SESSION_DB.
+# evict() убирает сессии, простаивающие дольше SESSION_TTL, и самые давние
+# сверх SESSION_MAX; вызывается периодически (handlers/collector).
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+
+IDLE = "idle"
+LIMIT = "limit"
+
+
+# Части сессии, которые хранятся по отдельности (в SQLite — столбцы с JSON)
+PARTS = ("photos", "fields", "photo_hashes", "duplicates")
+
+
+def _as_dict(survey_id: str, photos: dict, fields: dict, photo_hashes: dict, duplicates: dict) -> dict:
+    """Данные сессии в том виде, в каком их видят хендлеры: поля и фото шагов на верхнем уровне."""
+    data = dict(fields)
+    data.update((key, list(refs)) for key, refs in photos.items())
+    data["photo_hashes"] = dict(photo_hashes)
+    data["duplicates"] = dict(duplicates)
+    data["survey_id"] = survey_id
+    return data
+
+
+def _pick_evicted(touched: dict, ttl: float, max_sessions: int, keep) -> list:
+    """[(user_id, причина)] по {user_id: время последнего изменения}; keep не трогаются."""
+    cutoff = time.time() - ttl
+    candidates = sorted((t, uid) for uid, t in touched.items() if uid not in keep)
+    evicted = [(uid, IDLE) for t, uid in candidates if t < cutoff]
+    over = len(touched) - len(evicted) - max_sessions
+    if over > 0:
+        evicted += [(uid, LIMIT) for t, uid in candidates[len(evicted):len(evicted) + over]]
+    return evicted
+
+
+class Session:
+    """Сессия опроса в памяти процесса."""
+
+    __slots__ = ("step", "survey_id", "photos", "fields", "photo_hashes", "duplicates", "touched")
+
+    def __init__(self):
+        self.step: int = 0
+        self.survey_id: str = uuid.uuid4().hex
+        self.photos: Dict[str, List[str]] = {}       # ключ шага -> [ссылки на фото]
+        self.fields: Dict[str, Optional[str]] = {}   # распознанные поля документов
+        self.photo_hashes: Dict[str, str] = {}       # ссылка на фото -> перцептивный хэш
+        self.duplicates: Dict[str, str] = {}         # повтор -> оригинал
+        self.touched: float = time.time()
+
+    def to_dict(self) -> dict:
+        # Поверхностная копия: значения полей — строки, вложенные списки и словари копируются
+        return _as_dict(self.survey_id, self.photos, self.fields, self.photo_hashes, self.duplicates)
+
+
+class MemorySessionStore:
+    persistent = False
+
+    def __init__(self):
+        self._sessions = {}  # user_id -> Session
+        self._lock = threading.Lock()
+
+    def create(self, user_id) -> dict:
+        session = Session()
+        with self._lock:
+            self._sessions[user_id] = session
+        return session.to_dict()
+
+    def get_step(self, user_id):
+        with self._lock:
+            s = self._sessions.get(user_id)
+            return s.step if s else None
+
+    def get_data(self, user_id):
+        with self._lock:
+            s = self._sessions.get(user_id)
+            return s.to_dict() if s else None
+
+    def update(self, user_id, fields: dict) -> bool:
+        """Дописывает распознанные поля документов."""
+        with self._lock:
+            s = self._sessions.get(user_id)
+            if not s:
+                return False
+            s.fields.update(fields)
+            s.touched = time.time()
+            return True
+
+    def add_hashes(self, user_id, photo_hashes: dict, duplicates: dict) -> bool:
+        """Дописывает хэши новых фото и найденные среди них повторы ({повтор: оригинал})."""
+        with self._lock:
+            s = self._sessions.get(user_id)
+            if not s:
+                return False
+            s.photo_hashes.update(photo_hashes)
+            s.duplicates.update(duplicates)
+            s.touched = time.time()
+            return True
+
+    def append_photo(self, user_id, key: str, ref: str):
+        """Добавляет фото к элементу; возвращает число фото элемента или None без сессии."""
+        with self._lock:
+            s = self._sessions.get(user_id)
+            if not s:
+                return None
+            refs = s.photos.setdefault(key, [])
+            refs.append(ref)
+            s.touched = time.time()
+            return len(refs)
+
+    def advance(self, user_id):
+        """Атомарно переводит сессию на следующий шаг; возвращает (старый, новый) шаг или None."""
+        with self._lock:
+            s = self._sessions.get(user_id)
+            if not s:
+                return None
+            s.step += 1
+            s.touched = time.time()
+            return s.step - 1, s.step
+
+    def pop(self, user_id):
+        with self._lock:
+            s = self._sessions.pop(user_id, None)
+            return s.to_dict() if s else None
+
+    def user_ids(self) -> list:
+        with self._lock:
+            return list(self._sessions)
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+    def evict(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX, keep=()) -> list:
+        """Удаляет простаивающие и лишние сессии; возвращает [(user_id, data, причина)]."""
+        with self._lock:
+            touched = {uid: s.touched for uid, s in self._sessions.items()}
+            evicted = _pick_evicted(touched, ttl, max_sessions, set(keep))
+            return [(uid, self._sessions.pop(uid).to_dict(), reason) for uid, reason in evicted]
+
+
+_CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS sessions ("
+    " user_id INTEGER PRIMARY KEY,"
+    " step INTEGER NOT NULL,"
+    " survey_id TEXT NOT NULL,"
+    + "".join(f" {part} TEXT NOT NULL DEFAULT '{{}}'," for part in PARTS)
+    + " updated REAL NOT NULL)"
+)
+_SELECT_DATA = f"SELECT survey_id, {', '.join(PARTS)} FROM sessions WHERE user_id = ?"
+
+
+class SQLiteSessionStore:
+    persistent = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(_CREATE_TABLE)
+
+    def _conn(self) -> sqlite3.Connection:
+        # Отдельное соединение на поток: хендлеры и пул задач работают параллельно
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _modify(self, user_id, parts: tuple, fn):
+        """
+        Читает столбцы parts сессии, применяет fn(*значения) -> result (словари меняются на месте)
+        и пишет их обратно в одной транзакции. None — сессии нет.
+        """
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(f"SELECT {', '.join(parts)} FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            values = [json.loads(v) for v in row]
+            result = fn(*values)
+            db.execute(
+                f"UPDATE sessions SET {', '.join(f'{p} = ?' for p in parts)}, updated = ? WHERE user_id = ?",
+                (*(json.dumps(v, ensure_ascii=False) for v in values), time.time(), user_id),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    @staticmethod
+    def _row_dict(row) -> dict:
+        # row: survey_id и столбцы PARTS
+        return _as_dict(row[0], *(json.loads(v) for v in row[1:]))
+
+    def create(self, user_id) -> dict:
+        survey_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (user_id, step, survey_id, updated) VALUES (?, 0, ?, ?)",
+            (user_id, survey_id, time.time()),
+        )
+        return _as_dict(survey_id, {}, {}, {}, {})
+
+    def get_step(self, user_id):
+        row = self._conn().execute("SELECT step FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_data(self, user_id):
+        row = self._conn().execute(_SELECT_DATA, (user_id,)).fetchone()
+        return self._row_dict(row) if row else None
+
+    def update(self, user_id, fields: dict) -> bool:
+        """Дописывает распознанные поля документов."""
+        return bool(self._modify(user_id, ("fields",), lambda current: current.update(fields) or True))
+
+    def add_hashes(self, user_id, photo_hashes: dict, duplicates: dict) -> bool:
+        """Дописывает хэши новых фото и найденные среди них повторы ({повтор: оригинал})."""
+        def fn(hashes, dups):
+            hashes.update(photo_hashes)
+            dups.update(duplicates)
+            return True
+        return bool(self._modify(user_id, ("photo_hashes", "duplicates"), fn))
+
+    def append_photo(self, user_id, key: str, ref: str):
+        def fn(photos):
+            refs = photos.setdefault(key, [])
+            refs.append(ref)
+            return len(refs)
+        return self._modify(user_id, ("photos",), fn)
+
+    def advance(self, user_id):
+        row = self._conn().execute(
+            "UPDATE sessions SET step = step + 1, updated = ? WHERE user_id = ? RETURNING step",
+            (time.time(), user_id),
+        ).fetchone()
+        return (row[0] - 1, row[0]) if row else None
+
+    def pop(self, user_id):
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(_SELECT_DATA, (user_id,)).fetchone()
+            db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return self._row_dict(row) if row else None
+
+    def user_ids(self) -> list:
+        return [r[0] for r in self._conn().execute("SELECT user_id FROM sessions")]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def evict(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX, keep=()) -> list:
+        db = self._conn()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            touched = dict(db.execute("SELECT user_id, updated FROM sessions"))
+            evicted = []
+            for uid, reason in _pick_evicted(touched, ttl, max_sessions, set(keep)):
+                row = db.execute(_SELECT_DATA, (uid,)).fetchone()
+                db.execute("DELETE FROM sessions WHERE user_id = ?", (uid,))
+                evicted.append((uid, self._row_dict(row), reason))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return evicted
+
+
+def make_store():
+    kind = os.getenv("SESSION_STORE", "memory")
+    if kind == "sqlite":
+        return SQLiteSessionStore(os.getenv("SESSION_DB", "sessions.db"))
+    return MemorySessionStore()
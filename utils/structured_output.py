@@ -0,0 +1,138 @@
+# utils/structured_output.py
+#
+# Структурированные ответы GPT: pydantic-модели, response_format со строгой
+# JSON-схемой и разбор ответа с проверкой по модели. Для пакетного анализа
+# фото валидные элементы массива восстанавливаются по index даже из
+# обрезанного или частично испорченного ответа — повторно запрашиваются
+# только недостающие фото.
+
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import List, Literal
+
+from pydantic import BaseModel, ValidationError, create_model, field_validator
+
+from utils import metrics
+
+STATES = ("Категория V (аварийное состояние конструкции)", "неудовлетворительное", "удовлетворительное")
+
+
+def _join_list(value):
+    if isinstance(value, list):
+        return "; ".join(str(v).strip() for v in value if v)
+    return value
+
+
+class PhotoAssessment(BaseModel):
+    index: int
+    description: str
+    defects: str
+    overall_state: Literal[STATES]
+
+    _defects_list = field_validator("defects", mode="before")(_join_list)
+
+
+class PhotoBatch(BaseModel):
+    items: List[PhotoAssessment]
+
+
+class Conclusions(BaseModel):
+    overall_state: str
+    defects: str
+    recommendations: str
+
+    _defects_list = field_validator("defects", mode="before")(_join_list)
+
+
+@lru_cache(maxsize=None)
+def document_model(fields: tuple) -> type:
+    """Модель ответа распознавания документа с заданным набором строковых полей."""
+    return create_model("DocumentFields", **{f: (str, ...) for f in fields})
+
+
+def _strict(schema: dict) -> dict:
+    # strict-режим OpenAI: все поля обязательны, лишние запрещены, без default/title
+    if isinstance(schema, dict):
+        # title/default у схемы — строки/значения; словарь под таким ключом — это поле модели
+        for meta in ("title", "default"):
+            if meta in schema and not isinstance(schema[meta], dict):
+                del schema[meta]
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["required"] = list(schema["properties"])
+            schema["additionalProperties"] = False
+        for value in schema.values():
+            _strict(value)
+    elif isinstance(schema, list):
+        for value in schema:
+            _strict(value)
+    return schema
+
+
+def response_format(model: type, name: str) -> dict:
+    """response_format для chat.completions со строгой схемой модели."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": _strict(model.model_json_schema())},
+    }
+
+
+def _strip_fences(raw: str) -> str:
+    return re.sub(r"^```(?:json)?|```$", "", (raw or "").strip(), flags=re.MULTILINE).strip()
+
+
+def parse_model(raw: str, model: type):
+    """Экземпляр model из ответа или None, если ответ не проходит проверку."""
+    try:
+        parsed = model.model_validate_json(_strip_fences(raw))
+    except ValidationError as e:
+        metrics.inc("gpt_parse_events_total", schema=model.__name__, event="invalid")
+        metrics.trace("gpt_parse", schema=model.__name__, result="invalid")
+        logging.warning(f"Ответ GPT не соответствует схеме {model.__name__}: {e.errors()[:3]} -> {raw!r:.300}")
+        return None
+    metrics.inc("gpt_parse_events_total", schema=model.__name__, event="ok")
+    return parsed
+
+
+def _iter_array_objects(text: str):
+    # Объекты верхнего уровня первого JSON-массива; обрыв на середине просто завершает перебор
+    start = text.find("[")
+    if start < 0:
+        return
+    decoder = json.JSONDecoder()
+    pos = start + 1
+    while pos < len(text):
+        while pos < len(text) and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(text) or text[pos] == "]":
+            return
+        try:
+            obj, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return
+        yield obj
+
+
+def parse_photo_items(raw: str, count: int) -> dict:
+    """
+    {index: PhotoAssessment} для фото пакета из count штук.
+    Невалидные элементы и элементы с чужим или повторным index отбрасываются;
+    если index у элемента нет, используется его позиция в массиве.
+    """
+    items = {}
+    for pos, obj in enumerate(_iter_array_objects(_strip_fences(raw))):
+        if isinstance(obj, dict):
+            obj.setdefault("index", pos)
+        try:
+            item = PhotoAssessment.model_validate(obj)
+        except ValidationError:
+            continue
+        if 0 <= item.index < count and item.index not in items:
+            items[item.index] = item
+    event = "ok" if len(items) == count else "partial" if items else "invalid"
+    metrics.inc("gpt_parse_events_total", schema="PhotoBatch", event=event)
+    if event != "ok":
+        metrics.trace("gpt_parse", schema="PhotoBatch", result=event, parsed=len(items), expected=count)
+        logging.warning(f"Пакетный ответ GPT: разобрано {len(items)} из {count} фото")
+    return items
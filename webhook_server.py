@@ -0,0 +1,297 @@
+# webhook_server.py
+#
+# Приём обновлений Telegram по webhook (ASGI, uvicorn) с распределением по
+# WEBHOOK_WORKERS процессам. Каждый процесс — своё приложение
+# python-telegram-bot с хендлерами handlers/collector; обновление уходит в
+# процесс по консистентному хэшу effective_user.id (utils/hash_ring), так что
+# шаги одного пользователя обрабатываются по порядку одним процессом, а разные
+# пользователи — параллельно.
+#
+#   TELEGRAM_BOT_TOKEN=... WEBHOOK_URL=https://bot.example.com python webhook_server.py
+#
+# WEBHOOK_URL — внешний адрес сервера: при старте регистрируется webhook
+# <WEBHOOK_URL><WEBHOOK_PATH>. TELEGRAM_API_URL позволяет направить бота на
+# локальную замену Bot API (bench/fake_bot_api.py).
+#
+# Каждый воркер — полноценный процесс бота со своим пулом picture_embed
+# (PICTURE_WORKERS делится между воркерами). Локальный OCR (LOCAL_OCR) общий:
+# модель EasyOCR (~1 ГБ на процесс OCR_WORKERS) загружается один раз в процессе
+# менеджера, воркеры обращаются к нему через прокси. По умолчанию воркеров
+# столько же, сколько ядер; при нехватке памяти WEBHOOK_WORKERS уменьшают.
+
+import asyncio
+import hmac
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from multiprocessing.managers import BaseManager
+
+from telegram import Bot, Update
+from telegram.ext import Application, CommandHandler, ConversationHandler, MessageHandler, filters
+
+from utils import gpt_scheduler, metrics, ocr_service, picture_embed
+from utils.doc_extraction import LOCAL_OCR
+from utils.hash_ring import HashRing
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8080")))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 1)))
+# Необработанных обновлений на процесс; дальше отвечаем 503, и Telegram повторит доставку
+WEBHOOK_QUEUE = int(os.getenv("WEBHOOK_QUEUE", "1000"))
+
+stats = {"received": 0, "rejected": 0, "restarts": 0}
+_stats_lock = threading.Lock()
+
+
+# --- процесс-воркер ---
+
+def build_application(token: str = TELEGRAM_BOT_TOKEN) -> Application:
+    """Приложение бота с диалогом опроса; обновления подаются извне (без polling)."""
+    # Хендлеры импортируются в самом воркере: хранилище сессий и экспортер метрик — свои у процесса
+    from handlers import collector
+
+    app = (
+        Application.builder()
+        .token(token)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .updater(None)
+        .build()
+    )
+    app.add_handler(ConversationHandler(
+        entry_points=[CommandHandler("start", collector.start_conversation)],
+        states={1: [
+            MessageHandler(filters.PHOTO, collector.handle_photo),
+            CommandHandler("skip", collector.handle_skip),
+        ]},
+        fallbacks=[CommandHandler("cancel", collector.cancel)],
+    ))
+    return app
+
+
+def _worker_metrics(index: int):
+    # Порт и файл метрик у каждого процесса свои; METRICS_PORT остаётся за приёмом webhook
+    if metrics.METRICS_PORT:
+        metrics.METRICS_PORT += 1 + index
+    if metrics.METRICS_FILE:
+        metrics.METRICS_FILE = f"{metrics.METRICS_FILE}.{index}"
+
+
+def _next_update(updates):
+    # Воркер не демон (у него свои пулы процессов), поэтому сам выходит, если приём webhook умер
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            return updates.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return None
+
+
+async def _worker_loop(index: int, updates):
+    app = build_application()
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        logging.info(f"Воркер {index} (pid {os.getpid()}) готов")
+        while True:
+            data = await loop.run_in_executor(None, _next_update, updates)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+        await app.stop()
+
+
+class _OCRManager(BaseManager):
+    pass
+
+
+_OCRManager.register("OCRService", ocr_service.OCRService, exposed=("read_text", "warm_up", "shutdown"))
+
+
+def _worker_main(index: int, updates, ocr=None):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s [w{index}] %(levelname)s %(message)s")
+    _worker_metrics(index)
+    if ocr is not None:
+        ocr_service.set_service(ocr)
+    try:
+        asyncio.run(_worker_loop(index, updates))
+    finally:
+        # Дочерние пулы останавливаем сами: иначе выход процесса ждёт их воркеров.
+        # Общий OCR-сервис принадлежит приёму webhook и переживает перезапуск воркера
+        picture_embed.shutdown()
+        if ocr is None:
+            ocr_service.shutdown()
+
+
+# --- маршрутизация ---
+
+def update_user_id(data: dict):
+    """effective_user.id по сырому JSON обновления (None, если пользователя нет)."""
+    for key, value in data.items():
+        if key != "update_id" and isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user.get("id")
+            chat = value.get("chat")
+            if chat:
+                return chat.get("id")
+    return None
+
+
+class WebhookApp:
+    """ASGI-приложение: POST WEBHOOK_PATH принимает обновления, GET /health — состояние воркеров."""
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS):
+        self.workers = max(1, workers)
+        self.ring = HashRing(range(self.workers))
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(WEBHOOK_QUEUE) for _ in range(self.workers)]
+        self.processes = [None] * self.workers
+        self._manager = self.ocr = None
+
+    # --- воркеры ---
+
+    def _start_worker(self, index: int):
+        # Не daemon: демонам нельзя заводить дочерние процессы (пулы picture_embed и ocr_service)
+        proc = self._ctx.Process(target=_worker_main, args=(index, self.queues[index], self.ocr),
+                                 name=f"webhook-worker-{index}")
+        proc.start()
+        self.processes[index] = proc
+
+    def _ensure_alive(self, index: int):
+        proc = self.processes[index]
+        if proc is not None and not proc.is_alive():
+            logging.error(f"Воркер {index} завершился (код {proc.exitcode}), перезапускаю")
+            with _stats_lock:
+                stats["restarts"] += 1
+            self._start_worker(index)
+
+    async def startup(self):
+        metrics.start_exporter()
+        # Лимиты GPT общие на бота — делим поровну между процессами (spawn-процессы наследуют окружение)
+        os.environ["GPT_RPM"] = str(gpt_scheduler.GPT_RPM / self.workers)
+        os.environ["GPT_TPM"] = str(gpt_scheduler.GPT_TPM / self.workers)
+        os.environ["PICTURE_WORKERS"] = str(max(1, picture_embed.PICTURE_WORKERS // self.workers))
+        if LOCAL_OCR:
+            self._manager = _OCRManager(ctx=self._ctx)
+            self._manager.start()
+            self.ocr = self._manager.OCRService()
+        for index in range(self.workers):
+            self._start_worker(index)
+        if WEBHOOK_URL:
+            bot = Bot(TELEGRAM_BOT_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot")
+            async with bot:
+                await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET or None)
+        logging.info(f"Webhook {WEBHOOK_PATH}: воркеров {self.workers}")
+
+    async def shutdown(self):
+        for q in self.queues:
+            q.put(None)
+        await asyncio.to_thread(self._join_workers)
+        if self._manager is not None:
+            self.ocr.shutdown()
+            self._manager.shutdown()
+            self._manager = self.ocr = None
+        for q in self.queues:
+            q.close()
+            q.join_thread()
+        # Семафоры очередей освобождаются при сборке объектов (их держат поток записи и аргументы процессов)
+        self.queues, self.processes = [], []
+
+    def _join_workers(self, timeout: float = 10):
+        for proc in self.processes:
+            if proc is None:
+                continue
+            proc.join(timeout)
+            if proc.is_alive():
+                logging.warning(f"Воркер {proc.name} не завершился за {timeout} с, останавливаю")
+                proc.terminate()
+                proc.join(5)
+
+    def dispatch(self, data: dict) -> bool:
+        """Кладёт обновление в очередь воркера пользователя; False — очередь переполнена."""
+        user_id = update_user_id(data)
+        index = self.ring.node(user_id if user_id is not None else data.get("update_id"))
+        self._ensure_alive(index)
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            with _stats_lock:
+                stats["rejected"] += 1
+            metrics.inc("webhook_updates_total", status="rejected", worker=index)
+            return False
+        with _stats_lock:
+            stats["received"] += 1
+        metrics.inc("webhook_updates_total", status="accepted", worker=index)
+        return True
+
+    # --- ASGI ---
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await self.startup()
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await self.shutdown()
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        if scope["method"] == "GET" and scope["path"] == "/health":
+            alive = [p is not None and p.is_alive() for p in self.processes]
+            await _respond(send, 200 if all(alive) else 503, {"workers": alive, **stats})
+            return
+        if scope["method"] != "POST" or scope["path"] != WEBHOOK_PATH:
+            await _respond(send, 404, {"ok": False})
+            return
+
+        headers = dict(scope.get("headers") or [])
+        token = headers.get(b"x-telegram-bot-api-secret-token", b"").decode("latin-1")
+        if WEBHOOK_SECRET and not hmac.compare_digest(token, WEBHOOK_SECRET):
+            await _respond(send, 403, {"ok": False})
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        try:
+            data = json.loads(body)
+        except ValueError:
+            await _respond(send, 400, {"ok": False})
+            return
+        accepted = self.dispatch(data)
+        await _respond(send, 200 if accepted else 503, {"ok": accepted})
+
+
+async def _respond(send, status: int, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+def main():
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    uvicorn.run(WebhookApp(), host=WEBHOOK_HOST, port=WEBHOOK_PORT, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()